@@ -0,0 +1,105 @@
+# 可内存映射加载的模型文件: <prefix>.weights.pt 只保存state_dict张量, <prefix>.spec.json 保存网络结构(模型yaml的内容)和stride.
+# 加载时先在meta设备上按结构建图(不分配、不初始化权重), 再用 torch.load(mmap=True) 映射的张量直接替换参数,
+# 不需要反序列化完整的Model对象, 也不拷贝权重; 同一台机器上的多个worker进程通过页缓存共享同一份权重.
+# 卷积权重按channels_last布局保存, 加载后 model.to(memory_format=torch.channels_last) 不再拷贝;
+# 但 precision=fp16/bf16 的转换和对未折叠模型做BatchNorm折叠仍会生成新张量, 这部分权重不再与文件共享.
+import copy
+import hashlib
+import json
+import os
+
+import torch
+import torch.nn as nn
+
+SPEC_SUFFIX = '.spec.json'
+WEIGHTS_SUFFIX = '.weights.pt'
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _saved_layout(t):
+    """浮点张量保存为fp32; 4维张量与prepare_model中 model.to(memory_format=torch.channels_last) 的结果步长一致
+    (1x1卷积的权重两种布局都算连续, 只有用同一个转换才能保证加载后不再重排)"""
+    if not t.is_floating_point():
+        return t.contiguous()
+    t = t.float().contiguous()
+    return t.to(memory_format=torch.channels_last) if t.dim() == 4 else t
+
+
+def save_artifact(model, prefix):
+    """保存模型为 <prefix>.spec.json + <prefix>.weights.pt, 返回spec路径
+
+    保存的是传入模型当前的权重: 已折叠BatchNorm的模型加载后无需再次折叠.
+    4维浮点张量(卷积权重)按channels_last布局保存, torch.save保留步长, 加载后按EBikeDetector默认的
+    channels_last推理时 model.to(memory_format=...) 不拷贝, 权重仍由mmap映射
+    """
+    spec_path, weights_path = prefix + SPEC_SUFFIX, prefix + WEIGHTS_SUFFIX
+    state_dict = {k: _saved_layout(v.detach()) for k, v in model.state_dict().items()}
+    torch.save(state_dict, weights_path)
+
+    detect = model.model[-1]
+    spec = {
+        'md': model.md,  # 模型yaml的内容, 与 models/crowdgathered、models/normal_model 下的配置格式一致
+        'stride': [float(s) for s in detect.stride],
+        'weights': os.path.basename(weights_path),
+        'sha256': file_sha256(weights_path),
+    }
+    with open(spec_path, 'w', encoding='utf-8') as f:
+        json.dump(spec, f, ensure_ascii=False, indent=2)
+    print(f"模型结构已保存到: {spec_path}, 权重已保存到: {weights_path}")
+    return spec_path
+
+
+def build_model(spec):
+    """按spec在meta设备上构建Model, 不分配权重内存
+
+    不调用Model.__init__: 它会随机初始化权重并前向一次计算stride, 这里stride直接取自spec
+    """
+    from models.yolo import Model, parse_model
+
+    model = Model.__new__(Model)
+    nn.Module.__init__(model)
+    model.md = copy.deepcopy(spec['md'])
+    with torch.device('meta'):
+        model.model, model.save = parse_model(model.md, ch=[3])
+    detect = model.model[-1]
+    detect.stride = model.stride = torch.tensor(spec['stride'])
+    detect.grid = [torch.zeros(1)] * detect.nl
+    return model
+
+
+def _fuse_like(model, state_dict):
+    """state_dict中没有bn参数的Conv/DeConv按折叠后的结构处理: 去掉bn, 卷积带bias"""
+    for name, m in model.named_modules():
+        if not (isinstance(getattr(m, 'bn', None), nn.BatchNorm2d) and hasattr(m, 'fuseforward')):
+            continue
+        if f'{name}.bn.weight' in state_dict:
+            continue
+        conv = getattr(m, 'conv', None) or getattr(m, 'deconv', None)
+        if conv.bias is None:
+            conv.bias = nn.Parameter(torch.empty(conv.out_channels, device='meta'))
+        m.bn = None
+        m.forward = m.fuseforward
+
+
+def load_artifact(spec_path, map_location=None):
+    """加载save_artifact保存的模型, 权重通过mmap映射文件, 在CPU上不拷贝
+
+    之后转换为fp16/bf16或其他内存布局时权重会被拷贝到进程私有内存
+    """
+    with open(spec_path, encoding='utf-8') as f:
+        spec = json.load(f)
+    weights_path = os.path.join(os.path.dirname(spec_path), spec['weights'])
+    state_dict = torch.load(weights_path, map_location=map_location, mmap=True, weights_only=True)
+
+    model = build_model(spec)
+    _fuse_like(model, state_dict)
+    model.load_state_dict(state_dict, assign=True)
+    model.checksum = spec.get('sha256')
+    return model.requires_grad_(False).eval()
@@ -0,0 +1,74 @@
+import json
+import os
+
+import numpy as np
+import torch
+
+from postprocess_np import decode_outputs
+
+METADATA_KEY = 'ebike'  # ONNX metadata_props 中保存导出配置的键
+
+
+def quantized_weights_path(weights):
+    """quantize.py生成的INT8模型路径: 与FP32权重同名, 后缀为 _int8.torchscript"""
+    return os.path.splitext(weights)[0] + '_int8.torchscript'
+
+
+class ExportedModel:
+    """导出模型的推理后端基类, 调用方式与PyTorch模型一致: model(imgs)[0] 为解码后的预测 (bs, N, no)"""
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+        # 固定输入尺寸的模型, 预处理需letterbox到该尺寸; 动态尺寸为None
+        self.input_shape = None if metadata['dynamic'] else tuple(metadata['img_size'])
+
+    def __call__(self, imgs):
+        outputs = self.run(imgs)
+        if self.metadata['decode'] == 'graph':
+            pred = outputs[0]
+        else:
+            pred = decode_outputs(outputs, imgs.shape[2:], self.metadata['stride'], self.metadata['anchor_grid'])
+        return torch.from_numpy(pred).to(imgs.device), None
+
+    def run(self, imgs):
+        """执行一次前向推理, 返回numpy输出列表"""
+        raise NotImplementedError
+
+
+class OnnxRuntimeModel(ExportedModel):
+    """用ONNX Runtime在CPU上执行export.py导出的ONNX模型"""
+
+    def __init__(self, path, num_threads=0):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        metadata = self.session.get_modelmeta().custom_metadata_map[METADATA_KEY]
+        super(OnnxRuntimeModel, self).__init__(json.loads(metadata))
+
+    def run(self, imgs):
+        return self.session.run(None, {self.input_name: np.ascontiguousarray(imgs.cpu().numpy())})
+
+
+class TorchScriptModel(ExportedModel):
+    """执行export.py导出的TorchScript模型"""
+
+    def __init__(self, path, map_location=None):
+        extra_files = {'config.json': ''}
+        self.module = torch.jit.load(path, map_location=map_location, _extra_files=extra_files).eval()
+        super(TorchScriptModel, self).__init__(json.loads(extra_files['config.json']))
+        if self.metadata.get('quantized'):
+            torch.backends.quantized.engine = self.metadata['quantized']  # 与量化时使用的后端一致
+
+    def __call__(self, imgs):
+        if self.metadata['decode'] == 'graph':
+            return self.module(imgs), None  # 图内解码, 输出留在原设备上
+        return super(TorchScriptModel, self).__call__(imgs)
+
+    def run(self, imgs):
+        outputs = self.module(imgs)
+        return [o.cpu().numpy() for o in (outputs if isinstance(outputs, tuple) else (outputs,))]
@@ -0,0 +1,153 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+_upload_executor = None
+
+
+def upload_executor():
+    """process_upload默认使用的单线程线程池: 同一个模型同时只做一次前向推理
+
+    事件循环默认的线程池会让多个上传并发推理, 各自的torch算子线程互相抢占CPU, 逐层分析的hook也会互相干扰
+    """
+    global _upload_executor
+    if _upload_executor is None:
+        _upload_executor = ThreadPoolExecutor(max_workers=1)
+    return _upload_executor
+
+
+async def process_upload(detector, data, image_path, executor=None, visualize=True):
+    """异步处理一次上传: 解码、推理和写结果都在线程池中执行, 事件循环只等待结果
+
+    data为上传文件的字节, image_path只用于结果文件命名; 返回与process_and_save_results相同的结果.
+    executor默认为upload_executor()的单线程池
+    """
+    def process():
+        return detector.process_and_save_results(detector.load_image(data, image_path), visualize)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor or upload_executor(), process)
+
+
+class MicroBatcher:
+    """异步微批调度: 把并发到达的检测请求合并成一个batch推理
+
+    收到第一个请求后最多再等待max_wait_ms毫秒, 或凑满max_batch_size个请求即开始推理, 每个请求的future
+    得到属于自己的检测结果. max_wait_ms越大batch越满、吞吐越高, 但单个请求的排队延迟也越大.
+    推理在单独的线程中执行, 不阻塞事件循环; 一个batch推理期间下一个batch继续收集请求.
+    """
+
+    def __init__(self, detector, max_batch_size=8, max_wait_ms=10, conf_thres=0.3, iou_thres=0.5):
+        self.detector = detector
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self._queue = None
+        self._task = None
+        self._batch = []  # 正在收集或推理的batch, 停止时需要通知其中的请求
+        self._stopped = False
+        self._executor = ThreadPoolExecutor(max_workers=1)  # 模型只在一个线程中运行
+
+        # 统计
+        self.batches = 0
+        self.requests = 0
+        self.batch_sizes = {}  # batch大小 -> 次数
+        self.queue_wait = 0.0  # 请求排队等待的总时间(秒)
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """停止调度; 排队中和正在处理的请求以RuntimeError结束, 不会一直等待"""
+        self._stopped = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        pending, self._batch = self._batch, []
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, future, _ in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("MicroBatcher已停止"))
+        # 等待正在运行的batch结束, 放在默认线程池中等待以免阻塞事件循环
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+
+    async def detect(self, image):
+        """提交一张图像(load_image支持的任意输入), 等待并返回其检测结果; 读取和解码在推理线程中进行"""
+        if self._stopped:
+            raise RuntimeError("MicroBatcher已停止")
+        if self._queue is None:
+            raise RuntimeError("MicroBatcher未启动, 需要先调用start()")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        """等待第一个请求, 然后在max_wait_ms内继续收集, 最多max_batch_size个"""
+        loop = asyncio.get_running_loop()
+        batch = self._batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # 已被调用方取消的请求不再推理
+            batch = self._batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+
+            t = time.perf_counter()
+            self.batches += 1
+            self.requests += len(batch)
+            self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+            self.queue_wait += sum(t - submitted for _, _, submitted in batch)
+
+            images = [image for image, _, _ in batch]
+            results = await loop.run_in_executor(self._executor, self._detect_batch, images)
+            for (_, future, _), detections in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(detections, Exception):
+                    future.set_exception(detections)
+                else:
+                    future.set_result(detections)
+            self._batch = []
+
+    def _detect_batch(self, images):
+        """在推理线程中执行; 整个batch失败时逐张重试, 一张坏图不影响同batch的其他请求"""
+        try:
+            return self.detector.detect_batch(images, len(images), self.conf_thres, self.iou_thres)
+        except Exception as e:
+            if len(images) == 1:
+                return [e]
+        return [self._detect_batch([image])[0] for image in images]
+
+    def stats(self):
+        """微批统计: batch数量、平均batch大小、batch填充率和平均排队时间"""
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "batch_fill_ratio": self.requests / (self.batches * self.max_batch_size) if self.batches else 0.0,
+            "avg_queue_wait_ms": self.queue_wait / self.requests * 1000 if self.requests else 0.0,
+            "batch_size_counts": dict(sorted(self.batch_sizes.items())),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+        }
@@ -0,0 +1,518 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from detect_local import EBikeDetector, attempt_load, fused_postprocess, non_max_suppression, parse_shape
+from helpers import latency_stats, list_images, timed
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存(MB)"""
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024  # macOS单位为字节, Linux为KB
+
+
+def environment(opt):
+    """测试环境, 用于对比不同提交和机器上的结果"""
+    repo = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "time": time.strftime('%Y-%m-%dT%H:%M:%S'), "python": platform.python_version(),
+            "torch": torch.__version__, "opencv": cv2.__version__, "platform": platform.platform(),
+            "processor": platform.processor(), "cpu_count": os.cpu_count(), "torch_threads": torch.get_num_threads(),
+            "device": opt.device, "cuda": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+            "weights": os.path.basename(opt.weights)}
+
+
+def bench_tiled(opt):
+    """整图推理与切片推理对比: 耗时和检测数量"""
+    detector = EBikeDetector(opt.weights, opt.device)
+    rows = []
+    for image_path in list_images(opt.source):
+        image = detector.load_image(image_path)
+        image.img0  # 预先解码, 只比较推理耗时
+
+        # 预热一次, 排除首次调用的开销
+        detector.detect(image, opt.conf_thres, opt.iou_thres)
+        detector.detect_tiled(image, opt.tile_size, opt.tile_overlap, opt.batch_size, opt.conf_thres, opt.iou_thres)
+
+        full, t_full = timed(detector.detect, image, opt.conf_thres, opt.iou_thres)
+        tiled, t_tiled = timed(detector.detect_tiled, image, opt.tile_size, opt.tile_overlap, opt.batch_size,
+                               opt.conf_thres, opt.iou_thres)
+        rows.append({
+            "image": os.path.basename(image_path),
+            "shape": list(image.shape),
+            "full_ms": t_full * 1000,
+            "full_detections": len(full),
+            "tiled_ms": t_tiled * 1000,
+            "tiled_detections": len(tiled),
+        })
+
+    print('%-24s%14s%10s%8s%10s%8s' % ('image', 'shape', 'full_ms', 'n', 'tiled_ms', 'n'))
+    for r in rows:
+        print('%-24s%14s%10.1f%8d%10.1f%8d' % (r['image'], '%dx%d' % (r['shape'][1], r['shape'][0]), r['full_ms'],
+                                              r['full_detections'], r['tiled_ms'], r['tiled_detections']))
+    return {"mode": "tiled", "tile_size": opt.tile_size, "tile_overlap": opt.tile_overlap,
+            "batch_size": opt.batch_size, "rows": rows}
+
+
+def bench_fuse(opt):
+    """模型准备方式对比: 原始模型 / Conv+BN融合 / 融合+channels_last 的单张前向推理延迟"""
+    configs = [("raw", False, False), ("fused", True, False), ("fused+channels_last", True, True)]
+    x = torch.rand(1, 3, opt.height, opt.width, device=opt.device)
+    rows, ref = [], None
+    for name, fuse, channels_last in configs:
+        model = attempt_load(opt.weights, opt.device, fuse=fuse, channels_last=channels_last)
+        xi = x.contiguous(memory_format=torch.channels_last) if channels_last else x
+        latencies = []
+        with torch.inference_mode():
+            for i in range(opt.warmup + opt.iters):
+                t = time.perf_counter()
+                out = model(xi)[0]
+                if i >= opt.warmup:
+                    latencies.append(time.perf_counter() - t)
+        ref = out if ref is None else ref
+        rows.append({"config": name, **latency_stats(latencies), "max_abs_diff": float((out - ref).abs().max())})
+
+    print('%-22s%10s%10s%10s%12s' % ('config', 'mean_ms', 'p50_ms', 'min_ms', 'max_diff'))
+    for r in rows:
+        print('%-22s%10.1f%10.1f%10.1f%12.2e' % (r['config'], r['mean_ms'], r['p50_ms'], r['min_ms'], r['max_abs_diff']))
+    return {"mode": "fuse", "input_shape": list(x.shape), "iters": opt.iters, "rows": rows}
+
+
+def bench_postprocess(opt):
+    """后处理耗时: 完整解码+NMS 与 logit阈值过滤的融合后处理, 按不同置信度阈值(场景越空, 留下的候选越少)对比"""
+    detector = EBikeDetector(opt.weights, opt.device, fused_postprocess=True)
+    detect = detector.detect_layer
+    image = detector.load_image(list_images(opt.source)[0])
+    with torch.inference_mode():
+        feats = detector.model(detector.preprocess_image(image)[0])  # 各检测层原始输出
+        rows = []
+        for conf_thres in opt.conf_list:
+            candidates = int((detect.decode(list(feats))[..., 4] > conf_thres).sum())  # 高于阈值的anchor数
+            configs = [("decode+nms", lambda: non_max_suppression(detect.decode(list(feats)), conf_thres, opt.iou_thres)),
+                       ("fused", lambda: fused_postprocess(feats, detect, conf_thres, opt.iou_thres, opt.max_candidates))]
+            for name, fn in configs:
+                for _ in range(opt.warmup):
+                    fn()
+                latencies = []
+                for _ in range(opt.iters):
+                    det, t = timed(fn)
+                    latencies.append(t)
+                rows.append({"config": name, "conf_thres": conf_thres, "candidates": candidates,
+                             **latency_stats(latencies), "detections": len(det[0])})
+
+    print('%-14s%8s%12s%10s%10s%8s' % ('config', 'conf', 'candidates', 'mean_ms', 'p50_ms', 'n'))
+    for r in rows:
+        print('%-14s%8.3f%12d%10.3f%10.3f%8d' % (r['config'], r['conf_thres'], r['candidates'], r['mean_ms'], r['p50_ms'],
+                                               r['detections']))
+    return {"mode": "postprocess", "image": image.file_name, "max_candidates": opt.max_candidates, "rows": rows}
+
+
+def bench_requery(opt):
+    """同一张图换阈值查询: 每次完整推理 与 保留NMS前候选后只重新做NMS 的耗时对比"""
+    full = EBikeDetector(opt.weights, opt.device)
+    kept = EBikeDetector(opt.weights, opt.device, keep_candidates_mb=opt.keep_candidates_mb,
+                         candidate_floor=opt.candidate_floor)
+    rows = []
+    for path in list_images(opt.source):
+        image = kept.load_image(path)
+        _, first = timed(kept.detect, image, opt.conf_list[0], opt.iou_thres)  # 推理一次并保留候选
+        full_latencies, requery_latencies, same = [], [], True
+        for conf_thres in opt.conf_list:
+            expected, t = timed(full.detect, image, conf_thres, opt.iou_thres)
+            full_latencies.append(t)
+            results, t = timed(kept.detect, image, conf_thres, opt.iou_thres)
+            requery_latencies.append(t)
+            same = same and results == expected
+        rows.append({"image": image.file_name, "candidates": len(kept.cached_candidates(image)), "first_ms": first * 1000,
+                     "full": latency_stats(full_latencies), "requery": latency_stats(requery_latencies), "same": same})
+
+    print('%-24s%12s%10s%14s%16s%6s' % ('image', 'candidates', 'first_ms', 'full_p50_ms', 'requery_p50_ms', 'same'))
+    for r in rows:
+        print('%-24s%12d%10.1f%14.1f%16.2f%6s' % (r["image"], r["candidates"], r["first_ms"], r["full"]["p50_ms"],
+                                                   r["requery"]["p50_ms"], r["same"]))
+    return {"mode": "requery", "conf_list": opt.conf_list, "candidate_floor": opt.candidate_floor, "rows": rows}
+
+
+STARTUP_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, %(repo)r)
+import detect_local
+t1 = time.perf_counter()
+detector = detect_local.EBikeDetector(%(weights)r, %(device)r)
+t2 = time.perf_counter()
+detector.detect(%(image)r)
+t3 = time.perf_counter()
+print(json.dumps({"import_s": t1 - t0, "load_s": t2 - t1, "first_detect_s": t3 - t2,
+                  "torchvision_imported": "torchvision" in sys.modules}))
+"""
+
+
+def import_audit(repo, top=10):
+    """python -X importtime 统计detect_local直接导入的各模块的累计导入耗时, 按耗时排序"""
+    code = 'import sys; sys.path.insert(0, %r); import detect_local' % repo
+    err = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True).stderr
+    packages = {}
+    for line in err.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2  # 每层嵌套缩进两个空格
+        if cumulative.strip().isdigit() and depth == 1:
+            packages[name.strip()] = int(cumulative) / 1e6
+    return sorted(packages.items(), key=lambda kv: -kv[1])[:top]
+
+
+def bench_startup(opt):
+    """冷启动: 在新进程中导入detect_local、加载模型并完成第一次检测的耗时"""
+    repo = os.path.dirname(os.path.abspath(__file__))
+    image = list_images(opt.source)[0]
+    script = STARTUP_SCRIPT % {"repo": repo, "weights": opt.weights, "device": opt.device, "image": image}
+    runs = []
+    for _ in range(opt.repeats):
+        t = time.perf_counter()
+        out = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+        run = json.loads(out.strip().splitlines()[-1])
+        run["time_to_first_detection_s"] = time.perf_counter() - t  # 包括解释器启动
+        runs.append(run)
+
+    keys = ["import_s", "load_s", "first_detect_s", "time_to_first_detection_s"]
+    median = {k: float(np.median([r[k] for r in runs])) for k in keys}
+    audit = import_audit(repo)
+    print('%-28s%10s' % ('phase', 'median_s'))
+    for k in keys:
+        print('%-28s%10.3f' % (k, median[k]))
+    print('\n%-28s%10s' % ('package', 'import_s'))
+    for name, seconds in audit:
+        print('%-28s%10.3f' % (name, seconds))
+    return {"mode": "startup", "repeats": opt.repeats, "median": median, "runs": runs,
+            "import_audit": [{"package": name, "cumulative_s": seconds} for name, seconds in audit]}
+
+
+LATENCY_BUCKETS_MS = (10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+def histogram(latencies_ms, buckets=LATENCY_BUCKETS_MS):
+    """按上界分桶计数, 最后一个桶为超过最大上界的请求"""
+    return np.bincount(np.searchsorted(buckets, latencies_ms), minlength=len(buckets) + 1).tolist()
+
+
+def _request_latencies(weights, device, input_shapes, warmup, resolutions, order, conf_thres, iou_thres):
+    """在新进程中执行: 创建检测器, 按order依次检测各分辨率的图像, 返回每个请求的输入尺寸和耗时"""
+    detector = EBikeDetector(weights, device, input_shapes=input_shapes)
+    warmup_s = detector.warmup() if warmup else 0.0
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, (h, w, 3), np.uint8) for w, h in resolutions]
+    rows, seen = [], set()
+    for i in order:
+        image = detector.load_image(images[i])
+        shape = detector.input_shape(image.shape[:2])
+        _, t = timed(detector.detect, image, conf_thres, iou_thres)
+        rows.append({"resolution": "%dx%d" % resolutions[i], "input_shape": list(shape), "new_shape": shape not in seen,
+                     "ms": t * 1000})
+        seen.add(shape)
+    return {"warmup_s": warmup_s, "requests": rows}
+
+
+def bench_warmup(opt):
+    """首请求延迟: 自适应letterbox且不预热 / 规范输入尺寸+启动预热, 各在新进程中按相同顺序处理多种分辨率的图像"""
+    resolutions = [tuple(int(v) for v in r.lower().split('x')) for r in opt.resolutions]
+    order = np.random.default_rng(0).permutation(np.repeat(np.arange(len(resolutions)), opt.repeats)).tolist()
+    configs = [("auto", None, False), ("canonical+warmup", opt.input_shapes, True)]
+    rows = []
+    ctx = multiprocessing.get_context('spawn')  # 每个配置使用全新的进程, 不共享已生成的网格和卷积实现
+    for name, input_shapes, warmup in configs:
+        with ctx.Pool(1) as pool:
+            run = pool.apply(_request_latencies, (opt.weights, opt.device, input_shapes, warmup, resolutions, order,
+                                                  opt.conf_thres, opt.iou_thres))
+        ms = np.array([r["ms"] for r in run["requests"]])
+        new = np.array([r["new_shape"] for r in run["requests"]])
+        rows.append({"config": name, "warmup_s": run["warmup_s"],
+                     "input_shapes": len({tuple(r["input_shape"]) for r in run["requests"]}),
+                     "first_ms": float(ms[0]), "new_shape_p50_ms": float(np.median(ms[new])),
+                     "p50_ms": float(np.percentile(ms, 50)), "p99_ms": float(np.percentile(ms, 99)),
+                     "max_ms": float(ms.max()), "histogram": histogram(ms), "requests": run["requests"]})
+
+    print('%-18s%10s%8s%10s%14s%10s%10s%10s' % ('config', 'warmup_s', 'shapes', 'first_ms', 'new_shape_ms',
+                                                'p50_ms', 'p99_ms', 'max_ms'))
+    for r in rows:
+        print('%-18s%10.2f%8d%10.1f%14.1f%10.1f%10.1f%10.1f' % (r['config'], r['warmup_s'], r['input_shapes'],
+                                                               r['first_ms'], r['new_shape_p50_ms'], r['p50_ms'],
+                                                               r['p99_ms'], r['max_ms']))
+    print('\n%-12s' % 'latency_ms' + ''.join('%18s' % r['config'] for r in rows))
+    labels = ['<=%d' % b for b in LATENCY_BUCKETS_MS] + ['>%d' % LATENCY_BUCKETS_MS[-1]]
+    for i, label in enumerate(labels):
+        print('%-12s' % label + ''.join('%18d' % r['histogram'][i] for r in rows))
+    return {"mode": "warmup", "resolutions": opt.resolutions, "repeats": opt.repeats,
+            "buckets_ms": list(LATENCY_BUCKETS_MS), "rows": rows}
+
+
+def synthetic_images(directory, width, height, count):
+    """生成count张指定分辨率的JPEG: 低分辨率噪声放大后的平滑图像, 压缩后大小接近真实照片"""
+    rng = np.random.default_rng(0)
+    files = []
+    for i in range(count):
+        small = rng.integers(0, 256, (max(height // 32, 2), max(width // 32, 2), 3), np.uint8)
+        img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+        img = cv2.add(img, rng.integers(0, 16, img.shape, np.uint8))  # 细节纹理
+        path = os.path.join(directory, '%dx%d_%d.jpg' % (width, height, i))
+        cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        files.append(path)
+    return files
+
+
+def _suite_run(mode, weights, device, files, opt):
+    """在新进程中执行一种模式, 统计从读文件到得到检测结果的端到端耗时和峰值内存"""
+    detector = EBikeDetector(weights, device, fast_decode=opt["fast_decode"])
+    conf_thres, iou_thres, batch_size = opt["conf_thres"], opt["iou_thres"], opt["batch_size"]
+    detector.warmup(batch_sizes=sorted({1, batch_size}))
+
+    latencies = []
+    t0 = time.perf_counter()
+    if mode == 'single':
+        for path in files:
+            _, t = timed(lambda: detector.detect(detector.load_image(path), conf_thres, iou_thres))
+            latencies.append(t)
+    elif mode == 'batched':
+        for start in range(0, len(files), batch_size):
+            batch = files[start:start + batch_size]
+            _, t = timed(detector.detect_batch, batch, batch_size, conf_thres, iou_thres)
+            latencies.extend([t] * len(batch))  # batch内每张图的延迟都是整个batch的耗时
+    elif mode == 'tiled':
+        for path in files:
+            _, t = timed(lambda: detector.detect_tiled(detector.load_image(path), opt["tile_size"], opt["tile_overlap"],
+                                                       batch_size, conf_thres, iou_thres))
+            latencies.append(t)
+    elif mode == 'pipeline':
+        from pipeline import run_pipeline
+        files = [os.path.abspath(f) for f in files]
+        with tempfile.TemporaryDirectory() as results_dir:
+            os.chdir(results_dir)  # 流水线会把结果JSON写到当前目录的results下
+            run_pipeline(detector, files, batch_size=batch_size, conf_thres=conf_thres, iou_thres=iou_thres,
+                         visualize=False)
+    wall = time.perf_counter() - t0
+
+    row = {"mode": mode, "images": len(files), "wall_s": wall, "images_per_s": len(files) / wall}
+    row.update(latency_stats(latencies) if latencies else {})  # 流水线模式没有单张延迟
+    row["peak_rss_mb"] = peak_rss_mb()
+    return row
+
+
+def bench_suite(opt):
+    """端到端测试: 单张 / 批量 / 切片 / 文件夹流水线, 覆盖合成的各种分辨率和--source中的真实图片"""
+    workdir = tempfile.TemporaryDirectory(prefix='ebike_bench_')
+    datasets = []
+    for r in opt.resolutions:
+        w, h = (int(v) for v in r.lower().split('x'))
+        datasets.append((r, synthetic_images(workdir.name, w, h, opt.images)))
+    if opt.source and os.path.isdir(opt.source):
+        datasets.append(("real", list_images(opt.source)))
+
+    run_opt = {k: getattr(opt, k) for k in ("conf_thres", "iou_thres", "batch_size", "tile_size", "tile_overlap",
+                                            "fast_decode")}
+    ctx = multiprocessing.get_context('spawn')  # 每种模式在全新进程中运行, 峰值内存互不影响
+    rows = []
+    for name, files in datasets:
+        for mode in opt.modes:
+            with ctx.Pool(1) as pool:
+                row = pool.apply(_suite_run, (mode, opt.weights, opt.device, files, run_opt))
+            row["dataset"] = name
+            rows.append(row)
+    workdir.cleanup()
+
+    print('%-12s%-10s%8s%10s%10s%10s%10s%10s' % ('dataset', 'mode', 'images', 'img/s', 'p50_ms', 'p95_ms', 'p99_ms',
+                                                    'rss_mb'))
+    for row in rows:
+        print('%-12s%-10s%8d%10.2f%10s%10s%10s%10.0f' % (
+            row["dataset"], row["mode"], row["images"], row["images_per_s"],
+            *['%.1f' % row[k] if k in row else '-' for k in ("p50_ms", "p95_ms", "p99_ms")], row["peak_rss_mb"]))
+    return {"mode": "suite", "environment": environment(opt), "settings": {**run_opt, "images": opt.images},
+            "rows": rows}
+
+
+def bench_backend(opt):
+    """推理后端对比: PyTorch模型与export.py导出的TorchScript/ONNX模型的单张检测延迟"""
+    images = list_images(opt.source)
+    rows = []
+    for weights in [opt.weights] + opt.models:
+        detector = EBikeDetector(weights, opt.device)
+        contexts = [detector.load_image(image_path) for image_path in images]
+        for image in contexts:
+            image.img0  # 预先解码, 只比较预处理+推理+NMS耗时
+            detector.detect(image, opt.conf_thres, opt.iou_thres)  # 预热
+        latencies, detections = [], 0
+        for _ in range(opt.iters):
+            for image in contexts:
+                results, t = timed(detector.detect, image, opt.conf_thres, opt.iou_thres)
+                latencies.append(t)
+                detections += len(results)
+        rows.append({"weights": os.path.basename(weights), "backend": detector.backend, **latency_stats(latencies),
+                     "detections": detections // opt.iters})
+
+    print('%-28s%14s%10s%10s%10s%8s' % ('weights', 'backend', 'mean_ms', 'p50_ms', 'min_ms', 'n'))
+    for r in rows:
+        print('%-28s%14s%10.1f%10.1f%10.1f%8d' % (r['weights'], r['backend'], r['mean_ms'], r['p50_ms'], r['min_ms'],
+                                                r['detections']))
+    return {"mode": "backend", "iters": opt.iters, "rows": rows}
+
+
+def bench_layers(opt):
+    """逐层分析: 各层的平均耗时、耗时占比、FLOPs、参数量和激活内存, 找出最耗时的C3/SPP等模块"""
+    from profiler import LayerProfiler
+
+    model = attempt_load(opt.weights, opt.device, fuse=True, channels_last=opt.channels_last)
+    x = torch.rand(opt.batch_size, 3, opt.height, opt.width, device=opt.device)
+    if opt.channels_last:
+        x = x.contiguous(memory_format=torch.channels_last)
+    profiler = LayerProfiler(model, max_samples=opt.iters)
+    with torch.inference_mode():
+        for _ in range(opt.warmup):
+            model(x)
+        for _ in range(opt.iters):
+            with profiler.sample(x):
+                model(x)
+    profiler.print_summary(opt.top)
+    if opt.trace:
+        print(f"Chrome trace已保存到: {profiler.export_chrome_trace(opt.trace)}")
+    return {"mode": "layers", "input_shape": list(x.shape), "iters": opt.iters, "rows": profiler.summary()}
+
+
+def bench_head(opt):
+    """Detect解码耗时: 逐层解码后拼接 / 预分配输出的向量化解码 / 先按置信度过滤再解码"""
+    model = attempt_load(opt.weights, opt.device, fuse=True, channels_last=False)
+    detect = [m for m in model.modules() if hasattr(m, 'anchor_grid')][-1]
+    feats = []
+    handle = detect.register_forward_pre_hook(lambda m, args: feats.extend(t.clone() for t in args[0]))
+    with torch.inference_mode():
+        model(torch.rand(opt.batch_size, 3, opt.height, opt.width, device=opt.device))
+    handle.remove()
+
+    configs = [("cat", lambda x: detect._forward_cat(x)[0]), ("buffer", lambda x: detect.decode(x)),
+               ("buffer+conf_filter", lambda x: detect.decode(x, opt.conf_thres))]
+    rows, ref = [], None
+    with torch.inference_mode():
+        for name, fn in configs:
+            latencies = []
+            for i in range(opt.warmup + opt.iters):
+                x = list(feats)
+                t = time.perf_counter()
+                out = fn(x)
+                if i >= opt.warmup:
+                    latencies.append(time.perf_counter() - t)
+            ref = out if ref is None else ref
+            keep = ref[..., 4] > opt.conf_thres  # 过滤模式只保证高于阈值的anchor解码一致
+            rows.append({"config": name, **latency_stats(latencies),
+                         "max_abs_diff": float((out[keep] - ref[keep]).abs().max()) if keep.any() else 0.0})
+
+    print('%-22s%10s%10s%10s%12s' % ('config', 'mean_ms', 'p50_ms', 'min_ms', 'max_diff'))
+    for r in rows:
+        print('%-22s%10.3f%10.3f%10.3f%12.2e' % (r['config'], r['mean_ms'], r['p50_ms'], r['min_ms'], r['max_abs_diff']))
+    return {"mode": "head", "feature_shapes": [list(t.shape) for t in feats], "iters": opt.iters, "rows": rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='电动车检测性能测试')
+    parser.add_argument('--weights', type=str, default='pytorch_model.pt', help='模型权重路径')
+    parser.add_argument('--device', type=str, default='cpu', help='cpu 或 cuda:0')
+    parser.add_argument('--source', type=str, default='resources', help='测试图片文件夹')
+    parser.add_argument('--conf-thres', type=float, default=0.3)
+    parser.add_argument('--iou-thres', type=float, default=0.5)
+    parser.add_argument('--output', type=str, default='', help='将结果写入JSON文件')
+    sub = parser.add_subparsers(dest='mode', required=True)
+
+    p = sub.add_parser('tiled', help='整图推理与切片推理对比')
+    p.add_argument('--tile-size', type=int, default=640)
+    p.add_argument('--tile-overlap', type=float, default=0.2)
+    p.add_argument('--batch-size', type=int, default=8, help='每次前向推理的tile数')
+
+    p = sub.add_parser('fuse', help='Conv+BN融合与channels_last前后的前向推理延迟')
+    p.add_argument('--height', type=int, default=384)
+    p.add_argument('--width', type=int, default=640)
+    p.add_argument('--warmup', type=int, default=3)
+    p.add_argument('--iters', type=int, default=20)
+
+    p = sub.add_parser('layers', help='逐层耗时、FLOPs、参数量和激活内存')
+    p.add_argument('--height', type=int, default=384)
+    p.add_argument('--width', type=int, default=640)
+    p.add_argument('--batch-size', type=int, default=1)
+    p.add_argument('--channels-last', action='store_true')
+    p.add_argument('--warmup', type=int, default=3)
+    p.add_argument('--iters', type=int, default=20)
+    p.add_argument('--top', type=int, default=0, help='只打印最耗时的N层, 0为全部按顺序打印')
+    p.add_argument('--trace', type=str, default='', help='Chrome trace保存路径')
+
+    p = sub.add_parser('head', help='Detect解码的单帧耗时')
+    p.add_argument('--height', type=int, default=384)
+    p.add_argument('--width', type=int, default=640)
+    p.add_argument('--batch-size', type=int, default=1)
+    p.add_argument('--warmup', type=int, default=10)
+    p.add_argument('--iters', type=int, default=200)
+
+    p = sub.add_parser('postprocess', help='完整解码+NMS与融合后处理的耗时')
+    p.add_argument('--conf-list', type=float, nargs='+', default=[0.01, 0.1, 0.3, 0.5, 0.8])
+    p.add_argument('--max-candidates', type=int, default=3000, help='每张图进入NMS的最大候选数')
+    p.add_argument('--warmup', type=int, default=5)
+    p.add_argument('--iters', type=int, default=50)
+
+    p = sub.add_parser('requery', help='保留NMS前候选后, 同一张图换阈值重新查询与完整推理的耗时')
+    p.add_argument('--conf-list', type=float, nargs='+', default=[0.1, 0.2, 0.3, 0.4, 0.5])
+    p.add_argument('--candidate-floor', type=float, default=0.01, help='保留候选的objectness下限')
+    p.add_argument('--keep-candidates-mb', type=int, default=64)
+
+    p = sub.add_parser('startup', help='冷启动到第一次检测完成的耗时和导入耗时统计')
+    p.add_argument('--repeats', type=int, default=3, help='启动次数, 取中位数')
+
+    p = sub.add_parser('warmup', help='自适应输入尺寸与规范尺寸+预热的冷/热请求延迟分布')
+    p.add_argument('--resolutions', type=str, nargs='+',
+                   default=['1920x1080', '1280x720', '2560x1440', '640x480', '1600x1200', '1080x1920', '3840x2160'],
+                   help='合成图像的分辨率 宽x高, 模拟不同摄像头')
+    p.add_argument('--repeats', type=int, default=5, help='每种分辨率的请求数')
+    p.add_argument('--input-shapes', type=parse_shape, nargs='+', default=[(384, 640), (480, 640), (640, 640)],
+                   help='规范输入尺寸 高x宽')
+
+    p = sub.add_parser('suite', help='端到端测试: 吞吐、p50/p95/p99延迟和峰值内存, 结果可用--output保存为JSON')
+    p.add_argument('--modes', type=str, nargs='+', default=['single', 'batched', 'tiled', 'pipeline'],
+                   choices=['single', 'batched', 'tiled', 'pipeline'])
+    p.add_argument('--resolutions', type=str, nargs='+',
+                   default=['640x480', '1280x720', '1920x1080', '3840x2160', '5472x3648'],
+                   help='合成图片的分辨率 宽x高, 5472x3648为大疆无人机照片; --source存在时另外测试其中的真实图片')
+    p.add_argument('--images', type=int, default=8, help='每种分辨率的合成图片数')
+    p.add_argument('--batch-size', type=int, default=4, help='批量/流水线模式的batch, 切片模式下为每次推理的tile数')
+    p.add_argument('--tile-size', type=int, default=640)
+    p.add_argument('--tile-overlap', type=float, default=0.2)
+    p.add_argument('--fast-decode', action='store_true', help='JPEG按DCT缩放解码到接近推理尺寸')
+
+    p = sub.add_parser('backend', help='PyTorch与导出的TorchScript/ONNX模型的检测延迟')
+    p.add_argument('--models', type=str, nargs='+', default=[], help='export.py导出的.onnx或.torchscript文件')
+    p.add_argument('--iters', type=int, default=5, help='每张图片的测试次数')
+
+    opt = parser.parse_args()
+    torch.set_grad_enabled(False)
+    report = {"tiled": bench_tiled, "fuse": bench_fuse, "layers": bench_layers, "head": bench_head,
+              "postprocess": bench_postprocess, "requery": bench_requery, "startup": bench_startup, "warmup": bench_warmup, "suite": bench_suite,
+              "backend": bench_backend}[opt.mode](opt)
+
+    if opt.output:
+        with open(opt.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到: {opt.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,30 @@
 import os
 import sys
+import argparse
 import torch
 import cv2
 import numpy as np
 import torch.nn as nn
-import torchvision
+import io
+import math
+import copy
 import json
-from datetime import datetime
-from PIL import Image
-from PIL.ExifTags import TAGS, GPSTAGS
+import hashlib
+import logging
+import time
 
 # 添加当前目录到Python路径
 current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
     sys.path.append(current_dir)
 
+from metrics import STAGE_SECONDS, observe_layers, print_stage_summary, stage
+
+logger = logging.getLogger(__name__)
+
 # 导入必要的函数
-def attempt_load(weights, map_location=None):
-    """加载模型权重"""
+def attempt_load(weights, map_location=None, fuse=True, channels_last=False):
+    """加载模型权重, 并按prepare_model准备为推理模型"""
     # 使用weights_only=False来加载完整模型
     model_dict = torch.load(weights, map_location=map_location, weights_only=False)
     if isinstance(model_dict, dict) and 'model' in model_dict:
@@ -25,8 +32,114 @@ def attempt_load(weights, map_location=None):
         if hasattr(model, 'module'):
             model = model.module
         model = model.float().eval()
-        return model
-    return model_dict
+    else:
+        model = model_dict
+    return prepare_model(model, fuse, channels_last)
+
+def load_model(weights, map_location=None, fuse=True, channels_last=False):
+    """按权重文件后缀选择推理后端: .onnx用ONNX Runtime在CPU上执行, .torchscript用TorchScript,
+    .spec.json为export.py导出的可mmap加载的PyTorch模型, 其余为PyTorch模型"""
+    if weights.endswith('.spec.json'):
+        from artifact import load_artifact
+        return prepare_model(load_artifact(weights, map_location), fuse, channels_last).float().eval()
+    if weights.endswith('.onnx'):
+        from backends import OnnxRuntimeModel
+        return OnnxRuntimeModel(weights)
+    if weights.endswith('.torchscript'):
+        from backends import TorchScriptModel
+        return TorchScriptModel(weights, map_location)
+    return attempt_load(weights, map_location, fuse=fuse, channels_last=channels_last).float().eval()
+
+PRECISIONS = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+@torch.no_grad()
+def select_precision(model, precision='fp32', device='cpu'):
+    """确定推理精度: 在模型副本上用小输入试跑一次, 设备不支持该精度(算子缺失或输出非有限值)时回退到fp32"""
+    dtype = PRECISIONS[precision]
+    if dtype is torch.float32:
+        return dtype
+    device = torch.device(device)
+    if dtype is torch.bfloat16 and device.type == 'cuda' and not torch.cuda.is_bf16_supported():
+        logger.warning(f"设备 {device} 不支持 {precision}, 回退到fp32")
+        return torch.float32
+    try:
+        probe = to_precision(copy.deepcopy(model), dtype)
+        out = probe(torch.zeros(1, 3, 64, 64, dtype=dtype, device=device))[0]
+        if not torch.isfinite(out.float()).all():
+            raise RuntimeError('输出包含非有限值')
+    except Exception as e:
+        logger.warning(f"设备 {device} 不支持 {precision} 推理({str(e).splitlines()[0]}), 回退到fp32")
+        return torch.float32
+    return dtype
+
+def _float_inputs(module, args):
+    """Detect的输入转为fp32"""
+    return ([t.float() for t in args[0]],) + tuple(args[1:])
+
+def to_precision(model, dtype):
+    """将模型转换为dtype精度, Detect的网格解码保持fp32, 避免fp16/bf16下像素坐标的精度损失"""
+    model.to(dtype)
+    if dtype is not torch.float32:
+        for m in model.modules():
+            if hasattr(m, 'anchor_grid'):  # Detect
+                m.float()
+                m.register_forward_pre_hook(_float_inputs)
+    return model
+
+def fuse_conv_and_bn(conv, bn):
+    """将BatchNorm2d折叠进前面的Conv2d, 返回带bias的新卷积"""
+    fusedconv = nn.Conv2d(conv.in_channels, conv.out_channels, kernel_size=conv.kernel_size, stride=conv.stride,
+                          padding=conv.padding, dilation=conv.dilation, groups=conv.groups,
+                          bias=True).requires_grad_(False).to(conv.weight.device)
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)  # 每个输出通道的缩放
+    fusedconv.weight.copy_(conv.weight * scale.view(-1, 1, 1, 1))
+    b_conv = torch.zeros_like(bn.running_mean) if conv.bias is None else conv.bias
+    fusedconv.bias.copy_((b_conv - bn.running_mean) * scale + bn.bias)
+    return fusedconv
+
+def fuse_deconv_and_bn(deconv, bn):
+    """将BatchNorm2d折叠进前面的ConvTranspose2d, 返回带bias的新反卷积"""
+    fuseddeconv = nn.ConvTranspose2d(deconv.in_channels, deconv.out_channels, kernel_size=deconv.kernel_size,
+                                     stride=deconv.stride, padding=deconv.padding,
+                                     output_padding=deconv.output_padding, groups=deconv.groups, bias=True,
+                                     dilation=deconv.dilation).requires_grad_(False).to(deconv.weight.device)
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    # 反卷积权重形状为 (in, out/groups, kh, kw), 输出通道在第1维, 按组展开后缩放
+    g = deconv.groups
+    w = deconv.weight.view(g, deconv.in_channels // g, deconv.out_channels // g, *deconv.kernel_size)
+    fuseddeconv.weight.copy_((w * scale.view(g, 1, -1, 1, 1)).view_as(deconv.weight))
+    b_deconv = torch.zeros_like(bn.running_mean) if deconv.bias is None else deconv.bias
+    fuseddeconv.bias.copy_((b_deconv - bn.running_mean) * scale + bn.bias)
+    return fuseddeconv
+
+def _contiguous_inputs(module, args):
+    """Detect按NCHW布局对输入做view, channels_last输入需先转回连续布局"""
+    return ([t.contiguous() for t in args[0]],) + tuple(args[1:])
+
+@torch.no_grad()
+def prepare_model(model, fuse=True, channels_last=False):
+    """准备推理模型: 折叠Conv/DeConv与BatchNorm, 激活函数改为in-place, 可选channels_last内存布局"""
+    for m in model.modules():
+        if fuse and isinstance(getattr(m, 'bn', None), nn.BatchNorm2d) and hasattr(m, 'fuseforward'):
+            if isinstance(getattr(m, 'conv', None), nn.Conv2d):  # Conv
+                m.conv = fuse_conv_and_bn(m.conv, m.bn)
+                m.bn = None
+                m.forward = m.fuseforward
+            elif isinstance(getattr(m, 'deconv', None), nn.ConvTranspose2d):  # DeConv
+                m.deconv = fuse_deconv_and_bn(m.deconv, m.bn)
+                m.bn = None
+                m.forward = m.fuseforward
+
+        if isinstance(m, (nn.LeakyReLU, nn.ReLU, nn.ReLU6, nn.Hardswish, nn.SiLU)):
+            m.inplace = True
+        elif isinstance(m, nn.Upsample):
+            m.recompute_scale_factor = None  # 兼容新版本torch加载的旧模型
+        elif channels_last and hasattr(m, 'anchor_grid'):  # Detect
+            m.register_forward_pre_hook(_contiguous_inputs)
+
+    if channels_last:
+        model.to(memory_format=torch.channels_last)
+    return model.eval()
 
 def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleFill=False, scaleup=True, stride=32):
     # Resize and pad image while meeting stride-multiple constraints
@@ -60,6 +173,24 @@ def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleF
     im = cv2.copyMakeBorder(im, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)  # add border
     return im, ratio, (dw, dh)
 
+def letterbox_shape(shape, new_shape=(640, 640), auto=True, scaleup=True, stride=32):
+    """计算letterbox输出尺寸 [height, width], 不实际缩放图像"""
+    if isinstance(new_shape, int):
+        new_shape = (new_shape, new_shape)
+    r = min(new_shape[0] / shape[0], new_shape[1] / shape[1])
+    if not scaleup:
+        r = min(r, 1.0)
+    new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
+    if not auto:
+        return new_shape[0], new_shape[1]
+    dw, dh = new_shape[1] - new_unpad[0], new_shape[0] - new_unpad[1]
+    return new_unpad[1] + int(np.mod(dh, stride)), new_unpad[0] + int(np.mod(dw, stride))
+
+def parse_shape(value):
+    """解析命令行中的输入尺寸: "高x宽" 或边长"""
+    h, _, w = value.lower().partition('x')
+    return int(h), int(w or h)
+
 def xywh2xyxy(x):
     # Convert nx4 boxes from [x, y, w, h] to [x1, y1, x2, y2]
     y = x.clone() if isinstance(x, torch.Tensor) else np.copy(x)
@@ -71,16 +202,11 @@ def xywh2xyxy(x):
 
 def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, multi_label=False, max_det=300):
     """非极大值抑制"""
-    if prediction.dtype is torch.float16:
+    if prediction.dtype in (torch.float16, torch.bfloat16):
         prediction = prediction.float()  # to FP32
         
-    nc = prediction.shape[2] - 5  # number of classes
     xc = prediction[..., 4] > conf_thres  # candidates
     
-    # Settings
-    min_wh, max_wh = 2, 4096  # (pixels) minimum and maximum box width and height
-    max_nms = 30000  # maximum number of boxes into torchvision.ops.nms()
-    
     output = [torch.zeros((0, 6), device=prediction.device)] * prediction.shape[0]
     
     for xi, x in enumerate(prediction):  # image index, image inference
@@ -89,42 +215,119 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
         # If none remain process next image
         if not x.shape[0]:
             continue
-            
-        # Compute conf
-        x[:, 5:] *= x[:, 4:5]  # conf = obj_conf * cls_conf
-        
-        # Box (center x, center y, width, height) to (x1, y1, x2, y2)
-        box = xywh2xyxy(x[:, :4])
-        
-        # Detections matrix nx6 (xyxy, conf, cls)
-        if multi_label:
-            i, j = (x[:, 5:] > conf_thres).nonzero(as_tuple=True)
-            x = torch.cat((box[i], x[i, j + 5, None], j[:, None].float()), 1)
-        else:  # best class only
-            conf, j = x[:, 5:].max(1, keepdim=True)
-            x = torch.cat((box, conf, j.float()), 1)[conf.view(-1) > conf_thres]
-        
-        # Filter by class
-        if classes is not None:
-            x = x[(x[:, 5:6] == torch.tensor(classes, device=x.device)).any(1)]
+        output[xi] = nms_candidates(x, conf_thres, iou_thres, classes, agnostic, multi_label, max_det)
         
-        # Check shape
-        n = x.shape[0]  # number of boxes
-        if not n:  # no boxes
-            continue
-        elif n > max_nms:  # excess boxes
-            x = x[x[:, 4].argsort(descending=True)[:max_nms]]  # sort by confidence
-        
-        # Batched NMS
-        c = x[:, 5:6] * (0 if agnostic else max_wh)  # classes
-        boxes, scores = x[:, :4] + c, x[:, 4]  # boxes (offset by class), scores
-        i = torchvision.ops.nms(boxes, scores, iou_thres)  # NMS
-        if i.shape[0] > max_det:  # limit detections
-            i = i[:max_det]
-        output[xi] = x[i]
+    return output
+
+def nms_candidates(x, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, multi_label=False, max_det=300):
+    """对单张图像已解码的候选 (n, no) 做NMS, 返回 (n, 6) 的 xyxy, conf, cls"""
+    # Settings
+    min_wh, max_wh = 2, 4096  # (pixels) minimum and maximum box width and height
+    max_nms = 30000  # maximum number of boxes into torchvision.ops.nms()
+
+    if not x.shape[0]:
+        return torch.zeros((0, 6), device=x.device)
         
+    # Compute conf
+    x[:, 5:] *= x[:, 4:5]  # conf = obj_conf * cls_conf
+    
+    # Box (center x, center y, width, height) to (x1, y1, x2, y2)
+    box = xywh2xyxy(x[:, :4])
+    
+    # Detections matrix nx6 (xyxy, conf, cls)
+    if multi_label:
+        i, j = (x[:, 5:] > conf_thres).nonzero(as_tuple=True)
+        x = torch.cat((box[i], x[i, j + 5, None], j[:, None].float()), 1)
+    else:  # best class only
+        conf, j = x[:, 5:].max(1, keepdim=True)
+        x = torch.cat((box, conf, j.float()), 1)[conf.view(-1) > conf_thres]
+    
+    # Filter by class
+    if classes is not None:
+        x = x[(x[:, 5:6] == torch.tensor(classes, device=x.device)).any(1)]
+    
+    # Check shape
+    n = x.shape[0]  # number of boxes
+    if not n:  # no boxes
+        return torch.zeros((0, 6), device=x.device)
+    elif n > max_nms:  # excess boxes
+        x = x[x[:, 4].argsort(descending=True)[:max_nms]]  # sort by confidence
+    
+    # Batched NMS
+    import torchvision  # 延迟导入, 加快模块导入速度
+    c = x[:, 5:6] * (0 if agnostic else max_wh)  # classes
+    boxes, scores = x[:, :4] + c, x[:, 4]  # boxes (offset by class), scores
+    i = torchvision.ops.nms(boxes, scores, iou_thres)  # NMS
+    if i.shape[0] > max_det:  # limit detections
+        i = i[:max_det]
+    return x[i]
+
+def fused_postprocess(feats, detect, conf_thres=0.25, iou_thres=0.45, max_candidates=3000, max_det=300):
+    """融合后处理: 在Detect的原始输出上按objectness阈值过滤, 只对留下的anchor做sigmoid和解码, 再逐张做NMS
+
+    feats为各检测层的原始输出 (bs, na*no, ny, nx). objectness阈值换算为logit(sigmoid的反函数)后直接与原始输出比较,
+    低于阈值的anchor不做任何计算; 每张图按objectness最多保留max_candidates个候选进入NMS.
+    """
+    return [nms_candidates(x, conf_thres, iou_thres, max_det=max_det)
+            for x in fused_candidates(feats, detect, conf_thres, max_candidates)]
+
+def fused_candidates(feats, detect, conf_thres=0.25, max_candidates=3000):
+    """融合后处理中NMS之前的部分: 返回每张图objectness高于conf_thres的已解码候选 (n, no), 最多max_candidates个"""
+    bs, na, no = feats[0].shape[0], detect.na, detect.no
+    shapes = [tuple(f.shape[2:4]) for f in feats]
+    xy_gain, xy_offset, wh_gain = detect._decode_terms(shapes, feats[0].device, torch.float32)
+    if conf_thres <= 0:
+        logit = -math.inf
+    elif conf_thres >= 1:
+        logit = math.inf
+    else:
+        logit = math.log(conf_thres / (1 - conf_thres))
+
+    rows, images, start = [], [], 0
+    for f, (ny, nx) in zip(feats, shapes):
+        f = f.float().reshape(bs, na, no, ny * nx)
+        b, a, c = (f[:, :, 4] > logit).nonzero(as_tuple=True)
+        y = f[b, a, :, c].sigmoid()  # (k, no)
+        j = start + a * ny * nx + c  # 在拼接后各anchor中的下标
+        torch.addcmul(xy_offset[j], y[:, 0:2], xy_gain[j], out=y[:, 0:2])  # xy
+        y[:, 2:4].mul_(y[:, 2:4]).mul_(wh_gain[j])  # wh
+        rows.append(y)
+        images.append(b)
+        start += na * ny * nx
+    rows, images = torch.cat(rows), torch.cat(images)
+
+    output = []
+    for xi in range(bs):
+        x = rows[images == xi]
+        if x.shape[0] > max_candidates:  # pre-NMS top-k
+            x = x[x[:, 4].topk(max_candidates).indices]
+        output.append(x)
     return output
 
+class Candidates:
+    """一张图像NMS之前的候选, 用于只重新做NMS就按不同阈值重新查询结果
+
+    x为已解码的候选 (n, no): xywh(推理输入坐标)、objectness和类别概率, 保存在CPU上.
+    保持float32: 分数转为float16后NMS中分数相同的框的先后顺序会变化, 结果与重新推理不一致;
+    候选数已由下限阈值和max_candidates限制, 每张图最多几十KB. 同时记录推理输入和原图尺寸, 用于把结果缩放回原图
+    """
+
+    def __init__(self, x, img_shape, img0_shape):
+        self.x = x.detach().float().cpu()
+        self.img_shape = tuple(img_shape)
+        self.img0_shape = tuple(img0_shape)
+
+    def __len__(self):
+        return self.x.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.x.numel() * self.x.element_size()
+
+    def select(self, conf_thres):
+        """objectness高于conf_thres的候选 (n, no), 是新的张量, 可以直接交给nms_candidates(会原地修改)"""
+        return self.x[self.x[:, 4] > conf_thres]
+
 def scale_coords(img1_shape, coords, img0_shape, ratio_pad=None):
     """缩放坐标"""
     if ratio_pad is None:  # calculate from img0_shape
@@ -147,8 +350,124 @@ def clip_coords(boxes, img_shape):
     boxes[:, 2].clamp_(0, img_shape[1])  # x2
     boxes[:, 3].clamp_(0, img_shape[0])  # y2
 
+class ImageContext:
+    """单张图像的读取上下文: 文件只读一次, 像素只解码一次, EXIF从同一份字节中解析"""
+
+    def __init__(self, data, image_path=None, reduce_to=None):
+        self.data = data  # 原始文件字节
+        self.image_path = image_path
+        self.reduce_to = reduce_to  # 推理尺寸, 设置后JPEG按DCT缩放快速解码
+        self._img0 = None
+        self._reduced = None
+        self._shape = None
+        self._exif = None
+        self._content_hash = None
+
+    @classmethod
+    def from_path(cls, image_path, reduce_to=None):
+        with stage('read'), open(image_path, 'rb') as f:
+            data = f.read()
+        return cls(data, image_path, reduce_to)
+
+    @classmethod
+    def from_array(cls, img0, image_path=None):
+        """由已解码的BGR图像构造, 没有原始文件字节和EXIF"""
+        image = cls(None, image_path)
+        image._img0 = img0
+        return image
+
+    @property
+    def file_name(self):
+        """用于结果命名的文件名; 内存输入没有路径时使用内容哈希"""
+        if self.image_path:
+            return os.path.basename(self.image_path)
+        if self.data is None:
+            return hashlib.sha1(np.ascontiguousarray(self._img0).data).hexdigest()[:16] + '.jpg'
+        ext = '.png' if self.data[:4] == b'\x89PNG' else '.jpg'
+        return hashlib.sha1(self.data).hexdigest()[:16] + ext
+
+    @property
+    def content_hash(self):
+        """原始文件字节的sha256, 用作结果缓存的键; 没有文件字节(numpy数组输入)时为None"""
+        if self.data is None:
+            return None
+        if self._content_hash is None:
+            self._content_hash = hashlib.sha256(self.data).hexdigest()
+        return self._content_hash
+
+    @property
+    def img0(self):
+        """全分辨率解码的BGR图像, 首次访问时解码"""
+        if self._img0 is None:
+            self._img0 = self._decode(cv2.IMREAD_COLOR)
+        return self._img0
+
+    @property
+    def shape(self):
+        """全分辨率图像尺寸 (h, w, c), 快速解码模式下从文件头读取而不解码像素"""
+        if self._img0 is not None:
+            return self._img0.shape
+        if self._shape is None:
+            from PIL import Image
+            image = Image.open(io.BytesIO(self.data))
+            w, h = image.size
+            if image.getexif().get(0x0112) in (5, 6, 7, 8):  # EXIF方向为旋转90度, 解码后宽高互换
+                w, h = h, w
+            self._shape = (h, w, 3)
+        return self._shape
+
+    @property
+    def inference_img0(self):
+        """用于推理的BGR图像: JPEG在不小于推理尺寸的前提下按1/2、1/4或1/8缩放解码"""
+        if self._img0 is not None or not self.reduce_to or self.data[:2] != b'\xff\xd8':
+            return self.img0
+        if self._reduced is None:
+            h, w = self.shape[:2]
+            for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                 (2, cv2.IMREAD_REDUCED_COLOR_2)):
+                if max(h, w) // factor >= self.reduce_to:
+                    self._reduced = self._decode(flag)
+                    break
+            else:
+                return self.img0
+        return self._reduced
+
+    @property
+    def exif(self):
+        """EXIF数据, 从内存中的文件字节解析"""
+        if self._exif is None:
+            self._exif = get_exif_data(io.BytesIO(self.data)) if self.data is not None else {}
+        return self._exif
+
+    def _decode(self, flags):
+        with stage('decode'):
+            img = cv2.imdecode(np.frombuffer(self.data, np.uint8), flags)
+        if img is None:
+            raise ValueError(f"无法读取图像: {self.image_path}")
+        return img
+
+def tile_starts(length, tile_size, step):
+    """沿一个方向计算tile起点, 最后一个tile贴齐图像边缘"""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, step))
+    starts.append(length - tile_size)
+    return starts
+
+def merge_tile_detections(det, iou_thres=0.5, agnostic=False, max_det=300):
+    """跨tile合并检测结果: 对整图坐标下的检测框按类别再做一次NMS, 去除重叠区域的重复框"""
+    if not det.shape[0]:
+        return det
+    import torchvision
+    # 整图坐标可能超过4096, 类别偏移量取最大坐标
+    c = det[:, 5:6] * (0 if agnostic else det[:, :4].max() + 1)
+    i = torchvision.ops.nms(det[:, :4] + c, det[:, 4], iou_thres)
+    return det[i[:max_det]]
+
 def get_exif_data(image_path):
-    """获取图片的EXIF数据"""
+    """获取图片的EXIF数据, image_path也可以是文件对象"""
+    from PIL import Image
+    from PIL.ExifTags import TAGS, GPSTAGS
     try:
         image = Image.open(image_path)
         exif = image._getexif()
@@ -168,7 +487,7 @@ def get_exif_data(image_path):
             exif_data[tag] = data
         return exif_data
     except Exception as e:
-        print(f"读取EXIF数据时出错: {str(e)}")
+        logger.warning(f"读取EXIF数据时出错: {str(e)}")
         return {}
 
 def convert_to_degrees(value):
@@ -181,9 +500,9 @@ def convert_to_degrees(value):
     except:
         return None
 
-def get_image_metadata(image_path):
-    """获取图片元数据"""
-    exif_data = get_exif_data(image_path)
+def get_image_metadata(image):
+    """获取图片元数据, image为路径或ImageContext"""
+    exif_data = image.exif if isinstance(image, ImageContext) else get_exif_data(image)
     metadata = {
         "device_id": "DJI",  # 默认设备ID
         "timestamp": None,
@@ -223,126 +542,446 @@ def get_image_metadata(image_path):
     return metadata
 
 class EBikeDetector:
-    def __init__(self, weights_path='pytorch_model.pt', device='cuda:0' if torch.cuda.is_available() else 'cpu'):
+    def __init__(self, weights_path='pytorch_model.pt', device='cuda:0' if torch.cuda.is_available() else 'cpu',
+                 img_size=640, fast_decode=False, archive_dir=None, fuse=True, channels_last=True, int8=False,
+                 precision='fp32', fused_postprocess=True, max_candidates=3000, input_shapes=None, profile_every=0,
+                 cache=None, keep_candidates_mb=0, candidate_floor=0.01):
+        if int8:
+            # 加载quantize.py生成的INT8模型, 量化算子只有CPU实现
+            from backends import quantized_weights_path
+            weights_path, device = quantized_weights_path(weights_path), 'cpu'
         self.device = torch.device(device)
-        print(f"使用设备: {self.device}")
+        self.img_size = img_size  # 推理输入尺寸
+        self.auto = True  # letterbox只填充到stride的整数倍
+        self.fast_decode = fast_decode  # JPEG按DCT缩放解码到接近推理尺寸, 仅在可视化时才全分辨率解码
+        self.archive_dir = archive_dir  # 设置后, 以字节或文件对象传入的图像会另存一份原始文件
+        logger.info(f"使用设备: {self.device}")
         
-        # 加载模型
-        print(f"加载模型: {weights_path}")
-        self.model = attempt_load(weights_path, self.device)
-        self.model.float()
-        
-        # 设置为评估模式
-        self.model.eval()
+        # 加载模型, 导出的ONNX/TorchScript模型使用对应的推理后端
+        logger.info(f"加载模型: {weights_path}")
+        self.model = load_model(weights_path, self.device, fuse=fuse, channels_last=channels_last)
+        self.backend = 'torch' if isinstance(self.model, nn.Module) else os.path.splitext(weights_path)[1][1:]
+        self.channels_last = channels_last and self.backend == 'torch'  # 模型和输入使用NHWC内存布局, CPU上oneDNN卷积更快
+        # 推理精度, 导出的模型按导出时的精度运行; fp16/bf16会拷贝一份权重, .spec.json模型的权重因此不再与其他进程共享
+        self.dtype = torch.float32
+        if self.backend == 'torch':
+            self.dtype = select_precision(self.model, precision, self.device)
+            to_precision(self.model, self.dtype)
+        elif precision != 'fp32':
+            logger.warning(f"{self.backend} 后端不支持设置精度, 使用fp32")
+        # 融合后处理: Detect直接输出原始logit, 过滤、解码和NMS在fused_postprocess中完成; 导出的模型仍使用完整解码
+        self.detect_layer = None
+        if fused_postprocess and self.backend == 'torch':
+            self.detect_layer = [m for m in self.model.modules() if hasattr(m, 'anchor_grid')][-1]
+            self.detect_layer.raw_output = True
+        self.max_candidates = max_candidates  # 每张图进入NMS的最大候选数
+        # 逐层分析: 每profile_every次前向推理采样一次, 各层耗时写入ebike_layer_seconds指标
+        self.profiler = None
+        if profile_every and self.backend == 'torch':
+            from profiler import LayerProfiler
+            self.profiler = LayerProfiler(self.model, profile_every, on_sample=observe_layers).attach()
+        elif profile_every:
+            logger.warning(f"{self.backend} 后端不支持逐层分析")
+        # 规范输入尺寸 [(h, w), ...]: 设置后每张图letterbox到其中一个尺寸, 不同分辨率的图像不会产生新的输入形状,
+        # 网格和卷积实现都可以在warmup中提前准备好; 为None时按宽高比自适应填充到stride的整数倍
+        self.input_shapes = [tuple(int(math.ceil(v / 32) * 32) for v in shape) for shape in input_shapes or []]
+        if getattr(self.model, 'input_shape', None):
+            # 固定输入尺寸的导出模型, 所有图像letterbox到同一尺寸
+            self.img_size, self.auto = self.model.input_shape, False
+            self.input_shapes = [tuple(self.model.input_shape)]
         
+        # 检测结果缓存(result_cache.ResultCache), 键包含模型校验和与影响结果的推理配置
+        self.cache = cache
+        # 保留每张图candidate_floor以上的NMS前候选(内存中最多keep_candidates_mb), 同一张图换阈值时只重新做NMS
+        self.candidates = None
+        self.candidate_floor = candidate_floor
+        if keep_candidates_mb:
+            from result_cache import CandidateCache
+            self.candidates = CandidateCache(keep_candidates_mb * 2 ** 20)
+        self.model_tag = self._model_tag(weights_path) if cache is not None or self.candidates is not None else None
+
         # 禁用梯度计算
         torch.set_grad_enabled(False)
         
-        print("模型加载完成")
+        logger.info(f"模型加载完成, 推理精度: {str(self.dtype).replace('torch.', '')}")
+
+    def _model_tag(self, weights_path):
+        """模型权重的校验和加上输入尺寸、精度、解码方式等配置, 任何一项变化都不会命中旧的缓存"""
+        checksum = getattr(self.model, 'checksum', None)  # artifact.py加载的模型自带权重的sha256
+        if checksum is None:
+            from artifact import file_sha256
+            checksum = file_sha256(weights_path)
+        config = [checksum, self.backend, str(self.dtype), self.img_size, self.input_shapes, self.auto,
+                  self.fast_decode, self.detect_layer is not None, self.max_candidates]
+        return hashlib.sha256(json.dumps(config, default=str).encode()).hexdigest()
+
+    def cache_key(self, image, conf_thres, iou_thres):
+        """图像的结果缓存键, 未启用缓存或图像没有原始字节时为None"""
+        if self.cache is None or image.content_hash is None:
+            return None
+        from result_cache import cache_key
+        return cache_key(image.content_hash, self.model_tag, conf_thres, iou_thres)
+
+    def cached_results(self, image, conf_thres=0.3, iou_thres=0.5):
+        """缓存中的检测结果, 命中时不需要解码图像; 未命中返回None"""
+        key = self.cache_key(image, conf_thres, iou_thres)
+        return self.cache.get(key) if key is not None else None
+
+    def cache_results(self, image, results, conf_thres=0.3, iou_thres=0.5):
+        key = self.cache_key(image, conf_thres, iou_thres)
+        if key is not None:
+            self.cache.put(key, results)
+
+    def can_requery(self, conf_thres):
+        """是否可以用保留的候选回答conf_thres的查询: 阈值低于保留下限时候选不完整, 需要重新推理"""
+        return self.candidates is not None and conf_thres >= self.candidate_floor
+
+    def cached_candidates(self, image):
+        if self.candidates is None or image.content_hash is None:
+            return None
+        return self.candidates.get('%s|%s' % (image.content_hash, self.model_tag))
+
+    def keep_candidates(self, image, candidates):
+        if self.candidates is not None and image.content_hash is not None:
+            self.candidates.put('%s|%s' % (image.content_hash, self.model_tag), candidates)
+
+    @torch.inference_mode()
+    def predict_candidates(self, imgs, img0_shapes):
+        """前向推理, 返回每张图像objectness高于candidate_floor的NMS前候选(Candidates)"""
+        with stage('forward'):
+            out = self.model(imgs)
+            if self.device.type == 'cuda':
+                torch.cuda.synchronize(self.device)
+        with stage('candidates'):
+            if self.detect_layer is not None:
+                xs = fused_candidates(out, self.detect_layer, self.candidate_floor, self.max_candidates)
+            else:
+                pred = out[0].float()
+                xs = [x[x[:, 4] > self.candidate_floor] for x in pred]
+            return [Candidates(x, imgs.shape[2:], img0_shape) for x, img0_shape in zip(xs, img0_shapes)]
+
+    @torch.inference_mode()
+    def requery(self, candidates, conf_thres=0.3, iou_thres=0.5):
+        """只用保留的候选按新的阈值做NMS, 返回与detect相同格式的结果, 不需要图像和前向推理"""
+        with stage('nms'):
+            det = nms_candidates(candidates.select(conf_thres), conf_thres, iou_thres)
+        return self._collect_results(det, candidates.img_shape, candidates.img0_shape)
+
+    def load_image(self, image, image_path=None):
+        """返回供检测、元数据和可视化共用的ImageContext
 
-    def preprocess_image(self, image_path):
-        """预处理图像"""
+        image可以是文件路径、文件字节、文件对象、BGR格式的numpy数组或已有的ImageContext;
+        image_path为内存输入指定文件名, 用于结果文件命名
+        """
+        if isinstance(image, ImageContext):
+            return image
+        reduce_to = int(np.max(self.img_size)) if self.fast_decode else None
+        if isinstance(image, (str, os.PathLike)):
+            return ImageContext.from_path(image, reduce_to)
+        if isinstance(image, np.ndarray):
+            return ImageContext.from_array(image, image_path)
+        if hasattr(image, 'read'):
+            name = getattr(image, 'name', None)
+            image_path = image_path or (name if isinstance(name, str) else None)
+            image = image.read()
+
+        image = ImageContext(bytes(image), image_path, reduce_to)
+        if self.archive_dir:
+            self.archive_image(image)
+        return image
+
+    def archive_image(self, image):
+        """将内存中的原始图像字节保存到archive_dir"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        archive_path = os.path.join(self.archive_dir, image.file_name)
+        with open(archive_path, 'wb') as f:
+            f.write(image.data)
+        if image.image_path is None:
+            image.image_path = archive_path
+        return archive_path
+
+    def preprocess_image(self, image):
+        """预处理图像, image为load_image支持的任意输入; 返回输入tensor和原图尺寸"""
         # 读取图像
-        img0 = cv2.imread(image_path)
-        if img0 is None:
-            raise ValueError(f"无法读取图像: {image_path}")
+        image = self.load_image(image)
+        img0 = image.inference_img0
             
-        print(f"原始图像大小: {img0.shape}")
-        
-        # 预处理
-        img = letterbox(img0)[0]  # 自适应缩放和填充
-        img = img.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
-        img = np.ascontiguousarray(img)
+        logger.debug(f"原始图像大小: {image.shape}")
         
-        # 转换为tensor
-        img = torch.from_numpy(img).to(self.device)
-        img = img.float()
-        img /= 255.0  # 归一化到0-1
-        if len(img.shape) == 3:
-            img = img[None]  # 添加batch维度
+        # 预处理: 自适应缩放和填充, 转换为带batch维度的tensor
+        img = self.to_tensor([self.preprocess_array(img0)])
             
-        return img, img0
+        return img, image.shape
+
+    def input_shape(self, shape):
+        """原图尺寸shape (h, w) 对应的推理输入尺寸
+
+        设置了规范尺寸时, 在其中选缩放比例最大的(不超过自适应模式下的比例), 比例相同时选面积最小即填充最少的
+        """
+        if not self.input_shapes:
+            return letterbox_shape(shape, self.img_size, self.auto)
+        size = int(np.max(self.img_size))
+        r0 = min(size / shape[0], size / shape[1])
+        return max(self.input_shapes,
+                   key=lambda s: (round(min(s[0] / shape[0], s[1] / shape[1], r0), 6), -s[0] * s[1]))
+
+    def preprocess_array(self, img0, new_shape=None, auto=None):
+        """将BGR图像letterbox并转换为CHW、RGB的uint8数组, 不涉及tensor"""
+        if new_shape is None and self.input_shapes:
+            new_shape, auto = self.input_shape(img0.shape[:2]), False
+        with stage('letterbox'):
+            img = letterbox(img0, new_shape or self.img_size, auto=self.auto if auto is None else auto)[0]
+            img = img.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
+            return np.ascontiguousarray(img)
+
+    def to_tensor(self, imgs):
+        """将一组CHW的uint8数组堆叠为归一化后的batch tensor"""
+        with stage('h2d'):
+            imgs = torch.from_numpy(np.stack(imgs)).to(self.device)
+            imgs = imgs.to(self.dtype)
+            imgs /= 255.0  # 归一化到0-1
+            if self.channels_last:
+                imgs = imgs.contiguous(memory_format=torch.channels_last)
+            return imgs
+
+    def preprocess_batch(self, images):
+        """批量预处理: 将一组图像letterbox到共享尺寸后堆叠成一个batch, 返回batch tensor和各原图尺寸"""
+        images = [self.load_image(image) for image in images]
+        img0s = [image.inference_img0 for image in images]
+
+        # 取每张图自适应letterbox尺寸的最大值作为整个batch的输入尺寸
+        shapes = [self.input_shape(img0.shape[:2]) for img0 in img0s]
+        batch_shape = max(h for h, _ in shapes), max(w for _, w in shapes)
+        if self.input_shapes and batch_shape not in self.input_shapes:
+            # 混合了不同规范尺寸: 取能容纳整个batch的最小规范尺寸, 没有时取面积最大的
+            fits = [s for s in self.input_shapes if s[0] >= batch_shape[0] and s[1] >= batch_shape[1]]
+            batch_shape = min(fits or [max(self.input_shapes, key=lambda s: s[0] * s[1])], key=lambda s: s[0] * s[1])
+
+        imgs = self.to_tensor([self.preprocess_array(img0, batch_shape, auto=False) for img0 in img0s])
+        return imgs, [image.shape for image in images]
+
+    @torch.inference_mode()
+    def warmup(self, batch_sizes=(1,), repeats=2):
+        """预热: 对每个规范输入尺寸(未设置时为img_size的正方形)和batch大小各推理repeats次
+
+        生成Detect的解码系数缓存, 让oneDNN等后端为这些输入形状选好卷积实现, 并提前导入NMS用到的torchvision,
+        首个请求不再承担这些一次性开销. 返回耗时(秒)
+        """
+        import torchvision  # noqa: F401
+        t = time.perf_counter()
+        size = int(np.max(self.img_size))
+        for h, w in self.input_shapes or [self.input_shape((size, size))]:
+            for bs in batch_sizes:
+                imgs = self.to_tensor([np.full((3, h, w), 114, np.uint8)] * bs)
+                for _ in range(repeats):
+                    self.predict(imgs)
+        t = time.perf_counter() - t
+        logger.info(f"预热完成: {t:.2f}s")
+        return t
+
+    def _collect_results(self, det, img_shape, img0_shape):
+        """将单张图像的NMS输出缩放回原图并整理为结果列表"""
+        if det is None:
+            return []
+
+        # 将坐标缩放回原始图像大小
+        with stage('scale'):
+            det[:, :4] = scale_coords(img_shape, det[:, :4], img0_shape).round()
+            return self._format_results(det)
+
+    def _format_results(self, det):
+        """将原图坐标下的检测结果 (xyxy, conf, cls) 整理为结果列表"""
+        results = []
+        for *xyxy, conf, cls in det:
+            x1, y1, x2, y2 = [coord.item() for coord in xyxy]
+            results.append({
+                'bbox': [x1, y1, x2, y2],
+                'confidence': conf.item(),
+                'class': 'ebike'
+            })
+        return results
+
+    def predict(self, imgs, conf_thres=0.3, iou_thres=0.5):
+        """前向推理和后处理, 返回batch中每张图像的NMS结果 (n, 6), 坐标对应输入tensor"""
+        with stage('forward'):
+            out = self.model(imgs)
+            if self.device.type == 'cuda':
+                torch.cuda.synchronize(self.device)  # CUDA异步执行, 同步后耗时才计入forward而不是NMS
+        with stage('nms'):
+            if self.detect_layer is not None:
+                return fused_postprocess(out, self.detect_layer, conf_thres, iou_thres, self.max_candidates)
+            return non_max_suppression(out[0], conf_thres, iou_thres)
+
+    @torch.inference_mode()
+    def detect(self, image, conf_thres=0.3, iou_thres=0.5):
+        """检测图像中的电动车, image为路径、文件字节、文件对象、numpy数组或ImageContext"""
+        image = self.load_image(image)
+        results = self.cached_results(image, conf_thres, iou_thres)
+        if results is not None:
+            return results
+
+        if self.can_requery(conf_thres):
+            # 保留了这张图的候选时只重新做NMS, 否则推理一次并保留候选
+            candidates = self.cached_candidates(image)
+            if candidates is None:
+                img, shape0 = self.preprocess_image(image)
+                candidates = self.predict_candidates(img, [shape0])[0]
+                self.keep_candidates(image, candidates)
+            results = self.requery(candidates, conf_thres, iou_thres)
+            self.cache_results(image, results, conf_thres, iou_thres)
+            return results
 
-    def detect(self, image_path, conf_thres=0.3, iou_thres=0.5):
-        """检测图像中的电动车"""
         # 预处理图像
-        img, img0 = self.preprocess_image(image_path)
+        img, shape0 = self.preprocess_image(image)
         
-        # 推理
-        pred = self.model(img)[0]
-        
-        # NMS
-        pred = non_max_suppression(pred, conf_thres, iou_thres)
+        # 推理和NMS
+        pred = self.predict(img, conf_thres, iou_thres)
         
         # 处理检测结果
-        results = []
-        if pred[0] is not None:
-            det = pred[0]
-            
-            # 将坐标缩放回原始图像大小
-            det[:, :4] = scale_coords(img.shape[2:], det[:, :4], img0.shape).round()
-            
-            # 收集结果
-            for *xyxy, conf, cls in det:
-                x1, y1, x2, y2 = [coord.item() for coord in xyxy]
-                results.append({
-                    'bbox': [x1, y1, x2, y2],
-                    'confidence': conf.item(),
-                    'class': 'ebike'
-                })
-        
+        results = self._collect_results(pred[0], img.shape[2:], shape0)
+        self.cache_results(image, results, conf_thres, iou_thres)
         return results
 
-    def process_and_save_results(self, image_path):
-        """处理图片并保存结果"""
+    @torch.inference_mode()
+    def infer_batch(self, imgs, img0_shapes, conf_thres=0.3, iou_thres=0.5):
+        """对已预处理好的batch tensor做一次前向推理, 返回每张图像的结果"""
+        pred = self.predict(imgs, conf_thres, iou_thres)
+        return [self._collect_results(det, imgs.shape[2:], img0_shape) for det, img0_shape in zip(pred, img0_shapes)]
+
+    def detect_batch(self, images, batch_size=8, conf_thres=0.3, iou_thres=0.5):
+        """批量检测: 每batch_size张图像做一次前向推理, 按输入顺序返回每张图像的结果
+
+        命中结果缓存或保留了候选的图像不参与推理
+        """
+        images = [self.load_image(image) for image in images]
+        all_results = [self.cached_results(image, conf_thres, iou_thres) for image in images]
+        requery = self.can_requery(conf_thres)
+        misses = []
+        for i, results in enumerate(all_results):
+            if results is not None:
+                continue
+            candidates = self.cached_candidates(images[i]) if requery else None
+            if candidates is None:
+                misses.append(i)
+                continue
+            all_results[i] = self.requery(candidates, conf_thres, iou_thres)
+            self.cache_results(images[i], all_results[i], conf_thres, iou_thres)
+
+        for start in range(0, len(misses), batch_size):
+            batch = misses[start:start + batch_size]
+            imgs, shapes = self.preprocess_batch([images[i] for i in batch])
+
+            # 一次前向推理整个batch, NMS按batch维度逐张处理
+            if requery:
+                batch_results = []
+                for i, candidates in zip(batch, self.predict_candidates(imgs, shapes)):
+                    self.keep_candidates(images[i], candidates)
+                    batch_results.append(self.requery(candidates, conf_thres, iou_thres))
+            else:
+                batch_results = self.infer_batch(imgs, shapes, conf_thres, iou_thres)
+            for i, results in zip(batch, batch_results):
+                all_results[i] = results
+                self.cache_results(images[i], results, conf_thres, iou_thres)
+        return all_results
+
+    @torch.inference_mode()
+    def detect_tiled(self, image, tile_size=640, overlap=0.2, batch_size=8, conf_thres=0.3, iou_thres=0.5,
+                     full_frame=True):
+        """切片推理: 将高分辨率图像切成互相重叠的tile分批推理, 再合并回整图坐标
+
+        full_frame为True时额外做一次整图推理, 以保留跨越多个tile的大目标
+        """
+        image = self.load_image(image)
+        img0 = image.img0
+        h, w = img0.shape[:2]
+        step = max(int(tile_size * (1 - overlap)), 1)
+        origins = [(x, y) for y in tile_starts(h, tile_size, step) for x in tile_starts(w, tile_size, step)]
+
+        dets = []
+        for start in range(0, len(origins), batch_size):
+            batch = origins[start:start + batch_size]
+            crops = [img0[y:y + tile_size, x:x + tile_size] for x, y in batch]
+            imgs = self.to_tensor([self.preprocess_array(crop, tile_size, auto=False) for crop in crops])
+            pred = self.predict(imgs, conf_thres, iou_thres)
+
+            # tile内坐标 -> 整图坐标
+            for det, crop, (x, y) in zip(pred, crops, batch):
+                det[:, :4] = scale_coords(imgs.shape[2:], det[:, :4], crop.shape)
+                det[:, [0, 2]] += x
+                det[:, [1, 3]] += y
+                dets.append(det)
+
+        if full_frame:
+            img, shape0 = self.preprocess_image(image)
+            det = self.predict(img, conf_thres, iou_thres)[0]
+            det[:, :4] = scale_coords(img.shape[2:], det[:, :4], shape0)
+            dets.append(det)
+
+        det = merge_tile_detections(torch.cat(dets), iou_thres)
+        det[:, :4] = det[:, :4].round()
+        return self._format_results(det)
+
+    def process_and_save_results(self, image, visualize=True):
+        """处理图片并保存结果, image为load_image支持的任意输入"""
         try:
+            # 文件只读取和解码一次, 供检测、元数据和可视化共用
+            image = self.load_image(image)
+
             # 获取检测结果
-            detection_results = self.detect(image_path)
-            
-            # 获取图片元数据
-            metadata = get_image_metadata(image_path)
-            
-            # 构建完整的结果
-            result = {
-                "metadata": metadata,
-                "location": {
-                    "road_name": metadata["road_name"],
-                    "road_section": metadata["road_section"]
-                },
-                "detection_results": [
-                    {
-                        "bbox": det["bbox"],
-                        "confidence": det["confidence"],
-                        "class": det["class"]
-                    }
-                    for det in detection_results
-                ]
-            }
-            
-            # 保存JSON结果
-            base_name = os.path.splitext(os.path.basename(image_path))[0]
-            json_path = os.path.join("results", f"{base_name}_result.json")
-            
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(result, f, ensure_ascii=False, indent=2)
-            
-            print(f"结果已保存到: {json_path}")
-            
-            # 可视化结果
-            self.visualize(image_path, detection_results)
-            
-            return result
+            detection_results = self.detect(image)
+            return self.save_results(image, detection_results, visualize)
             
         except Exception as e:
-            print(f"处理图片时出错: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"处理图片时出错: {str(e)}")
             return None
 
-    def visualize(self, image_path, results):
-        """可视化检测结果"""
-        # 读取原始图像
-        img = cv2.imread(image_path)
+    def save_results(self, image, detection_results, visualize=True):
+        """根据检测结果生成JSON并保存可视化图像, image为load_image支持的任意输入"""
+        image = self.load_image(image)
+
+        # 获取图片元数据
+        with stage('exif'):
+            metadata = get_image_metadata(image)
+        
+        # 构建完整的结果
+        result = {
+            "metadata": metadata,
+            "location": {
+                "road_name": metadata["road_name"],
+                "road_section": metadata["road_section"]
+            },
+            "detection_results": [
+                {
+                    "bbox": det["bbox"],
+                    "confidence": det["confidence"],
+                    "class": det["class"]
+                }
+                for det in detection_results
+            ]
+        }
+        
+        # 保存JSON结果
+        base_name = os.path.splitext(image.file_name)[0]
+        json_path = os.path.join("results", f"{base_name}_result.json")
+        os.makedirs("results", exist_ok=True)
+        
+        with stage('json_write'), open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        
+        logger.debug(f"结果已保存到: {json_path}")
+        
+        # 可视化结果
+        if visualize:
+            with stage('visualize'):
+                self.visualize(image, detection_results)
+        
+        return result
+
+    def visualize(self, image, results):
+        """可视化检测结果, image为load_image支持的任意输入"""
+        # 复用已解码的原始图像
+        image = self.load_image(image)
+        img = image.img0.copy()
         
         # 绘制检测框
         for det in results:
@@ -358,18 +997,59 @@ class EBikeDetector:
             cv2.putText(img, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
         
         # 保存结果
-        output_path = os.path.join("results", os.path.basename(image_path).rsplit('.', 1)[0] + '_detected.' + image_path.rsplit('.', 1)[1])
+        base_name, ext = os.path.splitext(image.file_name)
+        output_path = os.path.join("results", base_name + '_detected' + (ext or '.jpg'))
         cv2.imwrite(output_path, img)
-        print(f"可视化结果已保存到: {output_path}")
+        logger.debug(f"可视化结果已保存到: {output_path}")
         
         return output_path
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, default='pytorch_model.pt', help='模型权重路径, 也可以是export.py导出的.onnx、.torchscript或.spec.json')
+    parser.add_argument('--int8', action='store_true', help='加载quantize.py生成的INT8模型(<weights>_int8.torchscript)')
+    parser.add_argument('--precision', type=str, default='fp32', choices=list(PRECISIONS), help='推理精度, 设备不支持时回退到fp32')
+    parser.add_argument('--source', type=str, default='resources', help='输入图片文件夹')
+    parser.add_argument('--batch-size', type=int, default=1, help='每次前向推理的图片数(切片模式下为tile数), 大于1时启用批量推理')
+    parser.add_argument('--img-size', type=int, default=640, help='推理输入尺寸')
+    parser.add_argument('--input-shapes', type=parse_shape, nargs='+', default=None,
+                        help='规范输入尺寸列表, 如 384x640 640x640; 每张图letterbox到其中一个尺寸')
+    parser.add_argument('--square', action='store_true', help='所有图像letterbox到 img-size x img-size')
+    parser.add_argument('--warmup', action='store_true', help='处理图片前按输入尺寸预热模型')
+    parser.add_argument('--log-level', type=str, default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    parser.add_argument('--stage-times', action='store_true', help='结束时打印各处理阶段的耗时统计')
+    parser.add_argument('--cache-dir', type=str, default='', help='检测结果缓存目录, 重复处理相同图片时直接返回结果')
+    parser.add_argument('--cache-size-mb', type=int, default=256, help='磁盘结果缓存的大小上限')
+    parser.add_argument('--profile-every', type=int, default=0, help='每N次前向推理做一次逐层分析, 0为不分析')
+    parser.add_argument('--profile-output', type=str, default='',
+                        help='逐层分析结果的保存路径, .trace.json 为Chrome trace格式, 其余为JSON')
+    parser.add_argument('--fast-decode', action='store_true', help='JPEG按DCT缩放解码到接近推理尺寸')
+    parser.add_argument('--no-visualize', action='store_true', help='不保存可视化图像')
+    parser.add_argument('--tile-size', type=int, default=0, help='切片推理的tile尺寸, 0表示整图推理')
+    parser.add_argument('--tile-overlap', type=float, default=0.2, help='相邻tile的重叠比例')
+    parser.add_argument('--pipeline', action='store_true', help='解码/推理/写结果流水线并行处理')
+    parser.add_argument('--decode-workers', type=int, default=4, help='流水线模式下解码线程数')
+    parser.add_argument('--write-workers', type=int, default=2, help='流水线模式下写结果线程数')
+    parser.add_argument('--queue-size', type=int, default=16, help='流水线模式下各级队列容量')
+    opt = parser.parse_args()
+    logging.basicConfig(level=opt.log_level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
     # 创建检测器
-    detector = EBikeDetector()
+    input_shapes = [(opt.img_size, opt.img_size)] if opt.square else opt.input_shapes
+    cache = None
+    if opt.cache_dir:
+        from result_cache import ResultCache
+        cache = ResultCache(os.path.join(opt.cache_dir, 'results.sqlite'), max_disk_bytes=opt.cache_size_mb * 2 ** 20)
+    detector = EBikeDetector(opt.weights, img_size=opt.img_size, fast_decode=opt.fast_decode, int8=opt.int8,
+                             precision=opt.precision, input_shapes=input_shapes, profile_every=opt.profile_every,
+                             cache=cache)
+    if opt.warmup:
+        detector.warmup(batch_sizes=sorted({1, opt.batch_size}) if not opt.tile_size else (1,))
+        STAGE_SECONDS.reset()  # 预热的耗时不计入统计
+    visualize = not opt.no_visualize
     
     # 获取resources文件夹中的所有图片
-    resources_dir = "resources"
+    resources_dir = opt.source
     image_extensions = ('.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG')
     image_files = [
         os.path.join(resources_dir, f) 
@@ -380,12 +1060,42 @@ def main():
     # 确保results文件夹存在
     os.makedirs("results", exist_ok=True)
     
-    # 处理每张图片
-    for image_path in image_files:
-        print(f"\n{'='*50}")
-        print(f"处理图片: {image_path}")
-        detector.process_and_save_results(image_path)
-        print(f"{'='*50}\n")
+    if opt.tile_size:
+        # 切片推理
+        for image_path in image_files:
+            logger.info(f"切片处理图片: {image_path}")
+            image = detector.load_image(image_path)
+            detection_results = detector.detect_tiled(image, opt.tile_size, opt.tile_overlap, opt.batch_size)
+            detector.save_results(image, detection_results, visualize)
+    elif opt.pipeline:
+        # 流水线处理
+        from pipeline import run_pipeline
+        run_pipeline(detector, image_files, batch_size=opt.batch_size, decode_workers=opt.decode_workers,
+                     write_workers=opt.write_workers, queue_size=opt.queue_size, visualize=visualize)
+    elif opt.batch_size > 1:
+        # 批量处理
+        for start in range(0, len(image_files), opt.batch_size):
+            batch = image_files[start:start + opt.batch_size]
+            logger.info(f"批量处理图片: {len(batch)} 张")
+            images = [detector.load_image(image_path) for image_path in batch]
+            for image, detection_results in zip(images, detector.detect_batch(images, opt.batch_size)):
+                detector.save_results(image, detection_results, visualize)
+    else:
+        # 处理每张图片
+        for image_path in image_files:
+            logger.info(f"处理图片: {image_path}")
+            detector.process_and_save_results(image_path, visualize)
+
+    if opt.stage_times:
+        print_stage_summary()
+    if cache is not None:
+        logger.info(f"结果缓存: {cache.stats}")
+    if detector.profiler is not None:
+        detector.profiler.print_summary()
+        if opt.profile_output.endswith('.trace.json'):
+            detector.profiler.export_chrome_trace(opt.profile_output)
+        elif opt.profile_output:
+            detector.profiler.export_json(opt.profile_output)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,150 @@
+import argparse
+import inspect
+import json
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from artifact import save_artifact
+from backends import METADATA_KEY
+from detect_local import attempt_load
+
+
+class ExportModel(nn.Module):
+    """导出用的包装模型
+
+    decode='graph': 网格解码在图内完成, 输出解码后的预测 (bs, N, no), 与PyTorch模型的 model(x)[0] 一致;
+    decode='host': 图内只做到sigmoid, 每个检测层输出 (bs, na, ny*nx, no), 由调用方按stride和anchor解码.
+    """
+
+    def __init__(self, model, decode='graph'):
+        super(ExportModel, self).__init__()
+        self.model = model
+        self.decode = decode
+
+    def forward(self, x):
+        if getattr(find_detect(self.model), 'raw_output', False):
+            # Detect只返回原始特征图, 导出的图会缺少解码, 输出的既不是预测也不是sigmoid后的特征
+            raise RuntimeError("Detect处于raw_output模式, 导出前需要设置 raw_output = False")
+        if self.decode == 'graph':
+            return self.model(x)[0]
+        return tuple(self.model(x))
+
+
+def find_detect(model):
+    """返回模型的Detect层"""
+    return [m for m in model.modules() if hasattr(m, 'anchor_grid')][-1]
+
+
+def export_metadata(detect, decode, img_shape, dynamic):
+    """导出配置, 推理后端据此决定输入尺寸和是否需要在图外解码"""
+    return {
+        'decode': decode,
+        'img_size': list(img_shape),
+        'dynamic': dynamic,
+        'nc': detect.nc,
+        'stride': [float(s) for s in detect.stride],
+        'anchor_grid': detect.anchor_grid.view(detect.nl, -1, 2).tolist(),  # 每个检测层的anchor (像素)
+    }
+
+
+def export_torchscript(traced, path, metadata):
+    torch.jit.save(traced, path, _extra_files={'config.json': json.dumps(metadata)})
+    print(f"TorchScript已保存到: {path}")
+    return path
+
+
+def export_onnx(traced, x, path, metadata, opset=12):
+    import onnx
+
+    output_names = ['output'] if metadata['decode'] == 'graph' else ['output%d' % i for i in range(len(metadata['stride']))]
+    dynamic_axes = {'images': {0: 'batch'}}
+    if metadata['dynamic']:
+        dynamic_axes['images'].update({2: 'height', 3: 'width'})
+    for name in output_names:
+        dynamic_axes[name] = {0: 'batch', 1: 'anchors'} if metadata['dynamic'] else {0: 'batch'}
+
+    # 使用基于TorchScript的导出器, 新版本torch默认的dynamo导出器不接受已trace的模型
+    kwargs = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    torch.onnx.export(traced, x, path, opset_version=opset, input_names=['images'], output_names=output_names,
+                      dynamic_axes=dynamic_axes, do_constant_folding=True, **kwargs)
+
+    # 将导出配置写入模型元数据
+    model = onnx.load(path)
+    onnx.checker.check_model(model)
+    meta = model.metadata_props.add()
+    meta.key, meta.value = METADATA_KEY, json.dumps(metadata)
+    onnx.save(model, path)
+    print(f"ONNX已保存到: {path}")
+    return path
+
+
+@torch.no_grad()
+def check_outputs(path, x, expected):
+    """用导出的模型重新推理一次, 打印与PyTorch输出的最大误差"""
+    if path.endswith('.onnx'):
+        try:
+            import onnxruntime
+        except ImportError:
+            print("未安装onnxruntime, 跳过ONNX输出校验")
+            return
+        session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+        outputs = session.run(None, {'images': x.cpu().numpy()})
+    else:
+        outputs = torch.jit.load(path, map_location=x.device)(x)
+        outputs = [o.cpu().numpy() for o in (outputs if isinstance(outputs, tuple) else (outputs,))]
+    diff = max(float(np.abs(o - e.cpu().numpy()).max()) for o, e in zip(outputs, expected))
+    print(f"{os.path.basename(path)} 与PyTorch输出的最大误差: {diff:.2e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导出TorchScript和ONNX模型')
+    parser.add_argument('--weights', type=str, default='pytorch_model.pt', help='模型权重路径')
+    parser.add_argument('--img-size', type=int, nargs='+', default=[640], help='导出输入尺寸: 边长, 或 高 宽')
+    parser.add_argument('--batch-size', type=int, default=1, help='示例输入的batch, 导出模型的batch维度可变')
+    parser.add_argument('--include', type=str, nargs='+', default=['torchscript', 'onnx'],
+                        choices=['torchscript', 'onnx', 'artifact'],
+                        help='artifact: 可mmap加载的 <prefix>.spec.json + <prefix>.weights.pt')
+    parser.add_argument('--decode', type=str, default='graph', choices=['graph', 'host'],
+                        help='graph: 网格解码在图内完成; host: 图外解码, 输出各检测层sigmoid后的结果')
+    parser.add_argument('--dynamic', action='store_true', help='ONNX输入的高和宽可变, 默认固定为--img-size')
+    parser.add_argument('--opset', type=int, default=12, help='ONNX opset版本')
+    parser.add_argument('--output', type=str, default='', help='输出文件路径前缀, 默认与权重同名')
+    opt = parser.parse_args()
+
+    img_shape = opt.img_size * 2 if len(opt.img_size) == 1 else opt.img_size[:2]
+    prefix = opt.output or os.path.splitext(opt.weights)[0]
+
+    # 在CPU上导出; 不使用channels_last, 导出的图按NCHW布局
+    model = attempt_load(opt.weights, 'cpu', fuse=True, channels_last=False).float()
+    if 'artifact' in opt.include:
+        save_artifact(model, prefix)  # 保存折叠BatchNorm后的权重, 加载时无需再折叠
+        if not {'torchscript', 'onnx'} & set(opt.include):
+            return
+
+    detect = find_detect(model)
+    detect.export = opt.decode == 'host'
+    detect.grid = [torch.zeros(1)] * detect.nl  # 清空网格缓存, trace时网格按输入尺寸在图内生成
+    metadata = export_metadata(detect, opt.decode, img_shape, opt.dynamic)
+
+    x = torch.rand(opt.batch_size, 3, *img_shape)
+    wrapper = ExportModel(model, opt.decode).eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(wrapper, x, check_trace=False)
+        expected = wrapper(x)
+        expected = expected if isinstance(expected, tuple) else (expected,)
+
+    paths = []
+    if 'torchscript' in opt.include:
+        paths.append(export_torchscript(traced, prefix + '.torchscript', metadata))
+    if 'onnx' in opt.include:
+        paths.append(export_onnx(traced, x, prefix + '.onnx', metadata, opt.opset))
+
+    for path in paths:
+        check_outputs(path, x, expected)
+
+
+if __name__ == '__main__':
+    main()
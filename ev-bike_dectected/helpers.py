@@ -0,0 +1,26 @@
+# bench.py、quantize.py等工具共用的小函数: 列出图片、计时和延迟统计; 只依赖NumPy, 不导入torch和detect_local.
+import os
+import time
+
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG')
+
+
+def list_images(source):
+    """列出文件夹中的所有图片"""
+    return sorted(os.path.join(source, f) for f in os.listdir(source) if f.endswith(IMAGE_EXTENSIONS))
+
+
+def timed(fn, *args, **kwargs):
+    """执行一次fn, 返回 (结果, 耗时秒)"""
+    t = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - t
+
+
+def latency_stats(latencies):
+    """延迟统计(毫秒)"""
+    a = np.array(latencies) * 1000
+    return {"mean_ms": float(a.mean()), "p50_ms": float(np.percentile(a, 50)), "p95_ms": float(np.percentile(a, 95)),
+            "p99_ms": float(np.percentile(a, 99)), "min_ms": float(a.min())}
@@ -0,0 +1,120 @@
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.request
+import uuid
+
+import numpy as np
+
+
+def multipart_body(field, filename, data):
+    """构造multipart/form-data请求体"""
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    a = np.array(latencies) * 1000
+    return {"p50_ms": float(np.percentile(a, 50)), "p95_ms": float(np.percentile(a, 95)),
+            "p99_ms": float(np.percentile(a, 99)), "max_ms": float(a.max())}
+
+
+def run(opt):
+    with open(opt.image, 'rb') as f:
+        body, content_type = multipart_body(opt.field, os.path.basename(opt.image), f.read())
+
+    latencies, errors = [], []
+    health_latencies = []
+    lock = threading.Lock()
+    remaining = [opt.requests]
+    stop = threading.Event()
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            req = urllib.request.Request(opt.url, data=body, headers={'Content-Type': content_type})
+            t = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=opt.timeout) as resp:
+                    resp.read()
+                with lock:
+                    latencies.append(time.perf_counter() - t)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    def health_probe():
+        # 检测进行时持续探测健康检查接口, 事件循环被阻塞时这里的延迟会明显升高
+        while not stop.is_set():
+            t = time.perf_counter()
+            try:
+                with urllib.request.urlopen(opt.health_url, timeout=opt.timeout) as resp:
+                    resp.read()
+                health_latencies.append(time.perf_counter() - t)
+            except Exception:
+                pass
+            stop.wait(opt.health_interval)
+
+    threads = [threading.Thread(target=worker) for _ in range(opt.concurrency)]
+    probe = threading.Thread(target=health_probe) if opt.health_url else None
+    t0 = time.perf_counter()
+    if probe:
+        probe.start()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    stop.set()
+    if probe:
+        probe.join()
+
+    report = {
+        "url": opt.url,
+        "concurrency": opt.concurrency,
+        "requests": opt.requests,
+        "errors": len(errors),
+        "wall_seconds": wall,
+        "requests_per_second": len(latencies) / wall if wall > 0 else 0.0,
+        "detect": percentiles(latencies),
+    }
+    if probe:
+        report["health"] = percentiles(health_latencies)
+    return report, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检测接口并发压测')
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:8000/detect', help='检测接口地址')
+    parser.add_argument('--health-url', type=str, default='', help='压测期间同时探测的健康检查接口')
+    parser.add_argument('--health-interval', type=float, default=0.05, help='健康检查探测间隔(秒)')
+    parser.add_argument('--image', type=str, default='resources/2.jpg', help='上传的图片')
+    parser.add_argument('--field', type=str, default='file', help='multipart表单字段名')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发请求数')
+    parser.add_argument('--requests', type=int, default=64, help='总请求数')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--output', type=str, default='', help='将结果写入JSON文件, 便于改动前后对比')
+    opt = parser.parse_args()
+
+    report, errors = run(opt)
+    for e in errors[:5]:
+        print(f"请求出错: {e}")
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if opt.output:
+        with open(opt.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到: {opt.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# 检测各处理阶段的耗时直方图, 按Prometheus文本格式导出, 不依赖prometheus_client.
+# 进程内全局统计; HTTP服务可以把 render() 的结果作为 /metrics 的响应体(Content-Type 为 CONTENT_TYPE),
+# 也可以用 start_http_server 单独开一个端口.
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """带标签的累积直方图, 线程安全"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # 标签值 -> [各桶计数, 总和, 总数]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        i = bisect.bisect_left(self.buckets, value)  # 第一个上界 >= value 的桶
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labelvalues):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, *labelvalues)
+
+    def summary(self):
+        """各标签的 (次数, 总耗时)"""
+        with self._lock:
+            return {labels: (count, total) for labels, (_, total, count) in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            series = sorted((labels, ([*counts], total, count)) for labels, (counts, total, count) in self._series.items())
+        for labels, (counts, total, count) in series:
+            pairs = ['%s="%s"' % (k, v) for k, v in zip(self.labelnames, labels)]
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_bucket{%s} %d' % (self.name, ','.join(pairs + ['le="%s"' % le]), cumulative))
+            suffix = '{%s}' % ','.join(pairs) if pairs else ''
+            lines.append('%s_sum%s %r' % (self.name, suffix, total))
+            lines.append('%s_count%s %d' % (self.name, suffix, count))
+        return lines
+
+
+STAGE_SECONDS = Histogram('ebike_stage_seconds', '检测各处理阶段的耗时(秒)', ['stage'])
+LAYER_SECONDS = Histogram('ebike_layer_seconds', '采样的前向推理中模型各层的耗时(秒)', ['layer'],
+                          buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+REGISTRY = [STAGE_SECONDS, LAYER_SECONDS]
+
+
+def observe_layers(sample):
+    """LayerProfiler的on_sample回调: 把一次采样中各层的耗时写入LAYER_SECONDS"""
+    for r in sample["layers"]:
+        LAYER_SECONDS.observe(r["ms"] / 1000, r["layer"])
+
+
+def stage(name):
+    """统计一个处理阶段的耗时: with stage('forward'): ..."""
+    return STAGE_SECONDS.time(name)
+
+
+def print_stage_summary():
+    """打印各阶段的调用次数、平均和累计耗时"""
+    summary = STAGE_SECONDS.summary()
+    print('%-12s%10s%12s%12s' % ('stage', 'count', 'mean_ms', 'total_s'))
+    for (name,), (count, total) in sorted(summary.items(), key=lambda kv: -kv[1][1]):
+        print('%-12s%10d%12.2f%12.2f' % (name, count, total / count * 1000, total))
+
+
+def render():
+    """所有指标的Prometheus文本格式"""
+    return '\n'.join(line for metric in REGISTRY for line in metric.render()) + '\n'
+
+
+def start_http_server(port, host='0.0.0.0'):
+    """在后台线程中提供 GET /metrics"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # 只有开启端口时才需要
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # 不为每次抓取打印访问日志
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,242 @@
+import argparse
+import logging
+import os
+import queue
+import secrets
+import threading
+from multiprocessing.connection import Client, Listener
+
+import metrics
+from detect_local import EBikeDetector, parse_shape
+
+DEFAULT_ADDRESS = ('127.0.0.1', 6001)
+# multiprocessing.connection会反序列化收到的每条消息, 能通过认证的客户端即可在推理进程中执行代码, 所以没有默认密钥:
+# 密钥取自环境变量, 否则由服务启动时随机生成并写入只有当前用户可读写(0600)的密钥文件, 客户端从同一文件读取
+AUTHKEY_ENV = 'EBIKE_MODEL_SERVER_AUTHKEY'
+AUTHKEY_FILE = os.environ.get('EBIKE_MODEL_SERVER_AUTHKEY_FILE',
+                              os.path.join(os.path.expanduser('~'), '.ebike_model_server.key'))
+
+logger = logging.getLogger(__name__)
+
+
+def load_authkey(path=AUTHKEY_FILE):
+    """客户端使用的密钥: 环境变量优先, 其次是服务写入的密钥文件"""
+    key = os.environ.get(AUTHKEY_ENV)
+    if key:
+        return key.encode()
+    try:
+        with open(path, 'rb') as f:
+            key = f.read().strip()
+    except FileNotFoundError:
+        key = b''
+    if not key:
+        raise RuntimeError(f"未找到推理服务密钥: 设置环境变量 {AUTHKEY_ENV} 或先启动服务生成 {path}")
+    return key
+
+
+def create_authkey(path=AUTHKEY_FILE):
+    """服务使用的密钥: 设置了环境变量时使用环境变量, 否则随机生成并写入权限为0600的文件"""
+    key = os.environ.get(AUTHKEY_ENV)
+    if key:
+        return key.encode()
+    key = secrets.token_hex(32).encode()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        os.fchmod(fd, 0o600)  # 文件已存在时open不会修改其权限
+        f.write(key)
+    logger.info(f"推理服务密钥已写入: {path}")
+    return key
+
+
+class _Request:
+    """一次检测请求, 由连接线程放入共享队列, 推理线程填写结果后唤醒连接线程"""
+
+    def __init__(self, data, conf_thres, iou_thres):
+        self.data = data
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class ModelServer:
+    """独立的推理进程: 进程内只加载一份模型, 所有HTTP worker通过本地socket把图像字节发过来
+
+    各连接的请求进入同一个队列, 推理线程每次取出队列中已有的请求(最多max_batch_size个)合并成一个batch推理
+    """
+
+    def __init__(self, detector, address=DEFAULT_ADDRESS, authkey=None, max_batch_size=8):
+        self.detector = detector
+        self.address = address
+        self.authkey = authkey or create_authkey()
+        self.max_batch_size = max_batch_size
+        self.requests = queue.Queue()
+
+    def serve_forever(self):
+        threading.Thread(target=self._inference_loop, daemon=True).start()
+        # 默认backlog为1, 客户端连接池同时建立多个连接时会卡在认证握手
+        with Listener(self.address, backlog=64, authkey=self.authkey) as listener:
+            logger.info(f"推理服务已启动: {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    logger.warning(f"接受连接时出错: {str(e)}")
+                    continue
+                threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+
+    def _handle_connection(self, conn):
+        """每个客户端连接一个线程: 接收请求, 等待推理结果后回复"""
+        with conn:
+            while True:
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    return
+                req = _Request(msg['image'], msg.get('conf_thres', 0.3), msg.get('iou_thres', 0.5))
+                self.requests.put(req)
+                req.done.wait()
+                conn.send({'error': req.error} if req.error else {'detections': req.result})
+
+    def _next_batch(self):
+        """阻塞等待第一个请求, 再取走队列中已有的请求, 凑成一个batch"""
+        batch = [self.requests.get()]
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _inference_loop(self):
+        while True:
+            batch = self._next_batch()
+            # 阈值不同的请求分组推理
+            groups = {}
+            for req in batch:
+                groups.setdefault((req.conf_thres, req.iou_thres), []).append(req)
+            for (conf_thres, iou_thres), reqs in groups.items():
+                self._run(reqs, conf_thres, iou_thres)
+
+    def _run(self, reqs, conf_thres, iou_thres):
+        try:
+            images = [self.detector.load_image(req.data) for req in reqs]
+            results = self.detector.detect_batch(images, len(images), conf_thres, iou_thres)
+            for req, detections in zip(reqs, results):
+                req.result = detections
+        except Exception as e:
+            logger.exception(f"批量推理时出错: {str(e)}")
+            # 整个batch失败时逐张重试, 避免一张坏图影响同batch的其他请求
+            if len(reqs) > 1:
+                for req in reqs:
+                    self._run([req], conf_thres, iou_thres)
+                return
+            reqs[0].error = str(e)
+        for req in reqs:
+            req.done.set()
+
+
+class ModelClient:
+    """推理服务客户端, 供HTTP worker使用; 线程安全, 连接断开后自动重连
+
+    每个连接同时只有一个请求, 客户端维护最多pool_size个连接: 同一worker中的并发请求各用一个连接同时发出,
+    在服务端的共享队列中才能合并成batch. authkey为None时每次建立连接前通过load_authkey读取(服务重启会换新密钥)
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None, pool_size=8):
+        self.address = address
+        self.authkey = authkey
+        self._idle = []  # 空闲连接
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def _connect(self):
+        return Client(self.address, authkey=self.authkey or load_authkey())
+
+    def detect(self, image_bytes, conf_thres=0.3, iou_thres=0.5):
+        """发送图像字节, 返回检测结果列表"""
+        with self._slots:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            for attempt in range(2):
+                try:
+                    if conn is None:
+                        conn = self._connect()
+                    conn.send({'image': image_bytes, 'conf_thres': conf_thres, 'iou_thres': iou_thres})
+                    reply = conn.recv()
+                    break
+                except (EOFError, OSError):
+                    if conn is not None:
+                        conn.close()
+                    conn = None
+                    if attempt:
+                        raise
+                except BaseException:
+                    if conn is not None:
+                        conn.close()  # 收发到一半的连接不能再复用
+                    raise
+            with self._lock:
+                self._idle.append(conn)
+        if 'error' in reply:
+            raise RuntimeError(f"推理服务出错: {reply['error']}")
+        return reply['detections']
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='电动车检测推理服务')
+    parser.add_argument('--weights', type=str, default='pytorch_model.pt', help='模型权重路径')
+    parser.add_argument('--device', type=str, default=None, help='cpu 或 cuda:0, 默认自动选择')
+    parser.add_argument('--host', type=str, default=DEFAULT_ADDRESS[0])
+    parser.add_argument('--port', type=int, default=DEFAULT_ADDRESS[1])
+    parser.add_argument('--max-batch-size', type=int, default=8, help='合并并发请求的最大batch')
+    parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'fp16', 'bf16'],
+                        help='推理精度, 设备不支持时回退到fp32')
+    parser.add_argument('--fast-decode', action='store_true', help='JPEG按DCT缩放解码到接近推理尺寸')
+    parser.add_argument('--img-size', type=int, default=640, help='推理输入尺寸')
+    parser.add_argument('--input-shapes', type=parse_shape, nargs='+', default=None,
+                        help='规范输入尺寸列表, 如 384x640 640x640; 不同分辨率的图像只会用到这几种输入形状')
+    parser.add_argument('--square', action='store_true', help='所有图像letterbox到 img-size x img-size')
+    parser.add_argument('--no-warmup', action='store_true', help='启动时不预热, 首个请求会明显变慢')
+    parser.add_argument('--archive-dir', type=str, default=None, help='保存收到的原始图像, 默认不落盘')
+    parser.add_argument('--cache-dir', type=str, default='', help='检测结果缓存目录, 相同图片和阈值直接返回缓存的结果')
+    parser.add_argument('--cache-size-mb', type=int, default=256, help='磁盘结果缓存的大小上限')
+    parser.add_argument('--keep-candidates-mb', type=int, default=0,
+                        help='在内存中保留图像NMS之前的候选, 同一张图换阈值请求时只重新做NMS; 0为不保留')
+    parser.add_argument('--candidate-floor', type=float, default=0.01, help='保留候选的objectness下限, 更低的阈值需要重新推理')
+    parser.add_argument('--profile-every', type=int, default=0,
+                        help='每N次前向推理做一次逐层分析, 各层耗时见/metrics的ebike_layer_seconds, 0为不分析')
+    parser.add_argument('--metrics-port', type=int, default=0, help='在该端口提供Prometheus格式的 GET /metrics, 0为不开启')
+    parser.add_argument('--log-level', type=str, default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    opt = parser.parse_args()
+    logging.basicConfig(level=opt.log_level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    kwargs = {'device': opt.device} if opt.device else {}
+    input_shapes = [(opt.img_size, opt.img_size)] if opt.square else opt.input_shapes
+    cache = None
+    if opt.cache_dir:
+        from result_cache import ResultCache
+        cache = ResultCache(os.path.join(opt.cache_dir, 'results.sqlite'), max_disk_bytes=opt.cache_size_mb * 2 ** 20)
+    detector = EBikeDetector(opt.weights, img_size=opt.img_size, fast_decode=opt.fast_decode,
+                             archive_dir=opt.archive_dir, precision=opt.precision, input_shapes=input_shapes,
+                             profile_every=opt.profile_every, cache=cache,
+                             keep_candidates_mb=opt.keep_candidates_mb, candidate_floor=opt.candidate_floor, **kwargs)
+    if not opt.no_warmup:
+        # 开始接受连接前预热单张和最大batch的输入
+        detector.warmup(batch_sizes=sorted({1, opt.max_batch_size}))
+        metrics.STAGE_SECONDS.reset()  # 预热的耗时不计入指标
+        metrics.LAYER_SECONDS.reset()
+    if opt.metrics_port:
+        metrics.start_http_server(opt.metrics_port, opt.host)
+        logger.info(f"指标端口: http://{opt.host}:{opt.metrics_port}/metrics")
+    ModelServer(detector, (opt.host, opt.port), max_batch_size=opt.max_batch_size).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
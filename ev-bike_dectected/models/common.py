@@ -3,15 +3,11 @@
 
 #from utils.utils import *
 
-import cv2
+import math
+
 import numpy as np
-import pandas as pd
-import requests
 import torch
 import torch.nn as nn
-from PIL import Image
-from torch.cuda import amp
-import pkg_resources as pkg
 
 def DWConv(c1, c2, k=1, s=1, act=True):
     # Depthwise convolution
@@ -90,7 +86,6 @@ class Focus(nn.Module):
     # Focus wh information into c-space
     def __init__(self, c1, c2, k=1, s=1, p=None, g=1, act=True):  # ch_in, ch_out, kernel, stride, padding, groups
         super(Focus, self).__init__()
-        print ("focus:", c1, c2)
         # self.conv1 = Conv(c1, c1, 3, 2, None, 1, True)
         # self.conv2 = Conv(c1, c1, 3, 2, None, 1, True)
         # self.conv3 = Conv(c1, c1, 3, 2, None, 1, True)
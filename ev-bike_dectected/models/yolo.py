@@ -1,7 +1,7 @@
 import argparse
+import math
 import numpy as np
-#from models.experimental import *
-import pdb 
+from models.experimental import *
 import torch.nn as nn
 import torch_utils
 import torch
@@ -40,6 +40,9 @@ class Detect(nn.Module):
         self.anchor_grid_np = np.array(anchors).reshape([self.nl, 1, -1, 1, 1, 2])
         self.export = False  # onnx export
         self.prunemode = False 
+        self.decode_conf_thres = None  # 设置后只对objectness高于该阈值的anchor做xywh解码
+        self.raw_output = False  # 推理时直接返回各检测层原始输出, 由调用方完成解码(detect_local.fused_postprocess)
+        self._decode_cache = {}  # (各层尺寸, 设备, 精度) -> 解码系数
 
     def forward(self, x):
         """
@@ -53,6 +56,14 @@ class Detect(nn.Module):
             pass 
         # if self.export:
         #     return x 
+        if getattr(self, 'raw_output', False) and not self.training:
+            return x
+        if not (self.training or self.export or torch.jit.is_tracing()):
+            return self.decode(x, getattr(self, 'decode_conf_thres', None)), x
+        return self._forward_cat(x)
+
+    def _forward_cat(self, x):
+        """逐层解码后拼接, 训练、导出和trace时使用; trace时网格在图内按输入尺寸生成"""
         z = []  # inference output
         for i in range(self.nl):
             bs, _, ny, nx = x[i].shape  # x(bs,255,20,20) to x(bs,3,20,20,85)
@@ -71,7 +82,63 @@ class Detect(nn.Module):
                 z.append(y.view(bs, -1, self.no))
         
         return x if self.training or self.export else (torch.cat(z, 1), x)
-    
+
+    def decode(self, x, conf_thres=None):
+        """推理解码: 各检测层直接写入同一个预分配的输出 (bs, N, no), 再对整个输出一次完成sigmoid和xywh解码
+
+        conf_thres不为None时先只对objectness做sigmoid, 仅对高于阈值的anchor做其余通道的sigmoid和xywh解码;
+        其余anchor除objectness外保留原始输出, 它们会被NMS按同一阈值过滤掉.
+        x中各层替换为 (bs, na, ny, nx, no) 的视图, 不做拷贝.
+        """
+        bs = x[0].shape[0]
+        shapes = [tuple(t.shape[2:4]) for t in x]
+        sizes = [self.na * ny * nx for ny, nx in shapes]
+        out = torch.empty(bs, sum(sizes), self.no, device=x[0].device, dtype=x[0].dtype)
+        xy_gain, xy_offset, wh_gain = self._decode_terms(shapes, x[0].device, x[0].dtype)
+
+        start = 0
+        for i, ((ny, nx), n) in enumerate(zip(shapes, sizes)):
+            x[i] = x[i].view(bs, self.na, self.no, ny, nx).permute(0, 1, 3, 4, 2)
+            out[:, start:start + n].view(bs, self.na, ny, nx, self.no).copy_(x[i])
+            start += n
+
+        if conf_thres is None:
+            out.sigmoid_()
+            y, j = out, slice(None)
+        else:
+            out[..., 4].sigmoid_()
+            b, j = (out[..., 4] > conf_thres).nonzero(as_tuple=True)
+            y = out[b, j]
+            y[:, :4].sigmoid_()
+            y[:, 5:].sigmoid_()
+        xy, wh = y[..., 0:2], y[..., 2:4]
+        torch.addcmul(xy_offset[j], xy, xy_gain[j], out=xy)  # xy
+        wh.mul_(wh).mul_(wh_gain[j])  # wh
+        if conf_thres is not None:
+            out[b, j] = y
+        return out
+
+    def _decode_terms(self, shapes, device, dtype):
+        """拼接各检测层后每个anchor的解码系数: xy = sig * xy_gain + xy_offset, wh = sig^2 * wh_gain
+
+        按 (各层尺寸, 设备, 精度) 缓存, 同一输入尺寸只计算一次
+        """
+        cache = getattr(self, '_decode_cache', None)
+        if cache is None:  # 旧版本保存的模型没有该属性
+            cache = self._decode_cache = {}
+        key = (tuple(shapes), device, dtype)
+        if key not in cache:
+            xy_gain, xy_offset, wh_gain = [], [], []
+            for i, (ny, nx) in enumerate(shapes):
+                s = float(self.stride[i])
+                grid = self._make_grid(nx, ny).to(device).expand(1, self.na, ny, nx, 2)
+                xy_gain.append(torch.full((self.na * ny * nx, 1), 2. * s, device=device))
+                xy_offset.append(((grid - 0.5) * s).reshape(-1, 2))
+                wh_gain.append((self.anchor_grid[i].to(device) * 4).expand(1, self.na, ny, nx, 2).reshape(-1, 2))
+            if len(cache) >= 16:  # 输入尺寸很多时避免缓存无限增长
+                cache.clear()
+            cache[key] = tuple(torch.cat(t).to(dtype) for t in (xy_gain, xy_offset, wh_gain))
+        return cache[key]
 
     def forward_inf_tensor(self, x):
         """
@@ -98,11 +165,9 @@ class Detect(nn.Module):
         z = []
         for i in range(self.nl):
             bs, _, ny, nx, _ = x[i].shape
-            print('[debug] bs={}, ny={}, nx={}'.format(bs, ny, nx))
             # Making the anchor grids 
             if self.grid_np[i].shape[2:4] != x[i].shape[2:4]:
                 self.grid_np[i] = self._make_grid_np(nx, ny)
-                print('making new grid')
 
             # y = x[i].sigmoid() 
             # y.shape = (bs,3,20,20,85)
@@ -191,7 +256,7 @@ class DetectFaceAndLandmark(nn.Module):
 
 
 class Model(nn.Module):
-    def __init__(self, model_cfg='yolov5s.yaml', ch=3, nc=None):  # model, input channels, number of classes
+    def __init__(self, model_cfg='yolov5s.yaml', ch=3, nc=None, verbose=False):  # model, input channels, number of classes
         super(Model, self).__init__()
         if type(model_cfg) is dict:
             self.md = model_cfg  # model dict
@@ -204,7 +269,7 @@ class Model(nn.Module):
         if nc and nc != self.md['nc']:
             print('Overriding %s nc=%g with nc=%g' % (model_cfg, self.md['nc'], nc))
             self.md['nc'] = nc  # override yaml value
-        self.model, self.save = parse_model(self.md, ch=[ch])  # model, savelist, ch_out
+        self.model, self.save = parse_model(self.md, ch=[ch], verbose=verbose)  # model, savelist, ch_out
         # print([x.shape for x in self.forward(torch.zeros(1, ch, 64, 64))])
 
         # Build strides, anchors
@@ -218,15 +283,16 @@ class Model(nn.Module):
             check_anchor_order(m)
             self.stride = m.stride
             self._initialize_biases()  # only run once
-            print('Strides: %s' % m.stride.tolist())
-            print('Normalized Anchors: %s' % m.anchors.tolist())
+            if verbose:
+                print('Strides: %s' % m.stride.tolist())
+                print('Normalized Anchors: %s' % m.anchors.tolist())
 
         # Init weights, biases
-        print ('init weights')
         torch_utils.initialize_weights(self)
         self._initialize_biases()  # only run once
-        torch_utils.model_info(self)
-        print('')
+        if verbose:
+            torch_utils.model_info(self)
+            print('')
 
     def reinit(self): 
         # Init weights, biases
@@ -256,28 +322,21 @@ class Model(nn.Module):
             return self.forward_once(x, profile)  # single-scale inference, train
 
     def forward_once(self, x, profile=False):
-        y, dt = [], []  # outputs
+        if profile:
+            # 逐层耗时、FLOPs、参数量和激活内存, 在本次前向推理中用hook统计, 见profiler.py
+            from profiler import LayerProfiler
+            profiler = LayerProfiler(self)
+            with profiler.sample(x):
+                x = self.forward_once(x)
+            profiler.print_summary()
+            return x
+
+        y = []  # outputs
         for m in self.model:
             if m.f != -1:  # if not from previous layer
                 x = y[m.f] if isinstance(m.f, int) else [x if j == -1 else y[j] for j in m.f]  # from earlier layers
-
-            if profile:
-                try:
-                    import thop
-                    o = thop.profile(m, inputs=(x,), verbose=False)[0] / 1E9 * 2  # FLOPS
-                except:
-                    o = 0
-                t = torch_utils.time_synchronized()
-                for _ in range(10):
-                    _ = m(x)
-                dt.append((torch_utils.time_synchronized() - t) * 100)
-                print('%10.1f%10.0f%10.1fms %-40s' % (o, m.np, dt[-1], m.type))
-
             x = m(x)  # run
             y.append(x if m.i in self.save else None)  # save output
-
-        if profile:
-            print('%.1fms total' % sum(dt))
         return x
 
     def _initialize_biases(self, cf=None):  # initialize biases into Detect(), cf is class frequency
@@ -311,8 +370,23 @@ class Model(nn.Module):
         torch_utils.model_info(self)
         return self
 
-def parse_model(md, ch):  # model_dict, input_channels(3)
-    print('\n%3s%18s%3s%10s  %-40s%-30s' % ('', 'from', 'n', 'params', 'module', 'arguments'))
+def make_divisible(x, divisor):
+    # Returns x evenly divisible by divisor
+    return math.ceil(x / divisor) * divisor
+
+def check_anchor_order(m):
+    # Check anchor order against stride order for YOLOv5 Detect() module m, and correct if necessary
+    a = m.anchor_grid.prod(-1).view(-1)  # anchor area
+    da = a[-1] - a[0]  # delta a
+    ds = m.stride[-1] - m.stride[0]  # delta s
+    if da.sign() != ds.sign():  # same order
+        print('Reversing anchor order')
+        m.anchors[:] = m.anchors.flip(0)
+        m.anchor_grid[:] = m.anchor_grid.flip(0)
+
+def parse_model(md, ch, verbose=False):  # model_dict, input_channels(3)
+    if verbose:
+        print('\n%3s%18s%3s%10s  %-40s%-30s' % ('', 'from', 'n', 'params', 'module', 'arguments'))
     anchors, nc, gd, gw = md['anchors'], md['nc'], md['depth_multiple'], md['width_multiple']
     na = (len(anchors[0]) // 2)  # number of anchors
     # if md['vis_score']:
@@ -365,14 +439,13 @@ def parse_model(md, ch):  # model_dict, input_channels(3)
         else:
             c2 = ch[f]
 
-        print ('=====')
-        print (m, args)
         # pdb.set_trace()
         m_ = nn.Sequential(*[m(*args) for _ in range(n)]) if n > 1 else m(*args)  # module
         t = str(m)[8:-2].replace('__main__.', '')  # module type
         np = sum([x.numel() for x in m_.parameters()])  # number params
         m_.i, m_.f, m_.type, m_.np = i, f, t, np  # attach index, 'from' index, type, number params
-        print('%3s%18s%3s%10.0f  %-40s%-30s' % (i, f, n, np, t, args))  # print
+        if verbose:
+            print('%3s%18s%3s%10.0f  %-40s%-30s' % (i, f, n, np, t, args))  # print
         save.extend(x % i for x in ([f] if isinstance(f, int) else f) if x != -1)  # append to savelist
         layers.append(m_)
         ch.append(c2)
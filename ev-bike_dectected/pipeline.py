@@ -0,0 +1,172 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 队列结束标记
+_STOP = object()
+
+
+class StageStats:
+    """单个流水线阶段的统计: 处理数量、忙碌时间以及输入队列深度"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.count = 0
+        self.busy = 0.0
+        self.depth_sum = 0
+        self.depth_max = 0
+        self.depth_samples = 0
+        self.lock = threading.Lock()
+
+    def record(self, n, seconds):
+        with self.lock:
+            self.count += n
+            self.busy += seconds
+
+    def sample_depth(self, q):
+        depth = q.qsize()
+        with self.lock:
+            self.depth_sum += depth
+            self.depth_max = max(self.depth_max, depth)
+            self.depth_samples += 1
+
+    def summary(self, wall):
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "items": self.count,
+            "throughput": self.count / wall if wall > 0 else 0.0,  # 张/秒
+            "busy_seconds": self.busy,
+            # 忙碌时间占(线程数 x 总时长)的比例, 接近1说明该阶段是瓶颈
+            "utilization": self.busy / (wall * self.workers) if wall > 0 else 0.0,
+            "queue_depth_avg": self.depth_sum / self.depth_samples if self.depth_samples else 0.0,
+            "queue_depth_max": self.depth_max,
+        }
+
+
+def _decode_worker(detector, path_queue, decoded_queue, write_queue, conf_thres, iou_thres, stats):
+    """解码阶段: 读取并解码图像(只读一次), 然后letterbox; 命中结果缓存的图像不解码, 直接交给写结果阶段"""
+    while True:
+        stats.sample_depth(path_queue)
+        image_path = path_queue.get()
+        if image_path is _STOP:
+            break
+        t = time.perf_counter()
+        try:
+            image = detector.load_image(image_path)
+            cached = detector.cached_results(image, conf_thres, iou_thres)
+            if cached is not None:
+                stats.record(1, time.perf_counter() - t)
+                write_queue.put((image, cached))
+                continue
+            img = detector.preprocess_array(image.inference_img0)
+        except Exception as e:
+            logger.error(f"预处理图像时出错: {image_path}: {str(e)}")
+            continue
+        stats.record(1, time.perf_counter() - t)
+        decoded_queue.put((image, img, image.shape))
+
+
+def _infer_stage(detector, decoded_queue, write_queue, batch_size, conf_thres, iou_thres, stats):
+    """推理阶段: 把相同输入尺寸的图像凑成batch, 单线程执行前向推理"""
+    batch = []
+
+    def flush():
+        t = time.perf_counter()
+        try:
+            imgs = detector.to_tensor([img for _, img, _ in batch])
+            results = detector.infer_batch(imgs, [shape for _, _, shape in batch], conf_thres, iou_thres)
+        except Exception as e:
+            logger.exception(f"批量推理时出错: {str(e)}")
+            batch.clear()
+            return
+        stats.record(len(batch), time.perf_counter() - t)
+        for (image, _, _), detection_results in zip(batch, results):
+            detector.cache_results(image, detection_results, conf_thres, iou_thres)
+            write_queue.put((image, detection_results))
+        batch.clear()
+
+    while True:
+        stats.sample_depth(decoded_queue)
+        try:
+            # 队列暂时为空时不再等待凑满batch, 先推理已有的图像
+            item = decoded_queue.get(timeout=0.05 if batch else None)
+        except queue.Empty:
+            flush()
+            continue
+        if item is _STOP:
+            break
+        if batch and batch[0][1].shape != item[1].shape:
+            flush()
+        batch.append(item)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+
+def _write_worker(detector, write_queue, visualize, stats):
+    """写结果阶段: 保存JSON和可视化图像"""
+    while True:
+        stats.sample_depth(write_queue)
+        item = write_queue.get()
+        if item is _STOP:
+            break
+        image, detection_results = item
+        t = time.perf_counter()
+        try:
+            detector.save_results(image, detection_results, visualize)
+        except Exception as e:
+            logger.error(f"保存结果时出错: {image.image_path}: {str(e)}")
+        stats.record(1, time.perf_counter() - t)
+
+
+def run_pipeline(detector, image_files, batch_size=8, decode_workers=4, write_workers=2, queue_size=16,
+                 conf_thres=0.3, iou_thres=0.5, visualize=True):
+    """以 解码 -> 推理 -> 写结果 三级流水线处理一组图片, 各级之间使用有界队列, 返回各阶段统计"""
+    path_queue = queue.Queue()
+    decoded_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+
+    decode_stats = StageStats("decode", decode_workers)
+    infer_stats = StageStats("infer", 1)
+    write_stats = StageStats("write", write_workers)
+
+    for image_path in image_files:
+        path_queue.put(image_path)
+    for _ in range(decode_workers):
+        path_queue.put(_STOP)
+
+    t0 = time.perf_counter()
+    decoders = [threading.Thread(target=_decode_worker, args=(detector, path_queue, decoded_queue, write_queue,
+                                                              conf_thres, iou_thres, decode_stats),
+                                 daemon=True) for _ in range(decode_workers)]
+    writers = [threading.Thread(target=_write_worker, args=(detector, write_queue, visualize, write_stats),
+                                daemon=True) for _ in range(write_workers)]
+    infer = threading.Thread(target=_infer_stage, args=(detector, decoded_queue, write_queue, batch_size,
+                                                         conf_thres, iou_thres, infer_stats), daemon=True)
+    for t in decoders + writers + [infer]:
+        t.start()
+
+    # 解码全部结束后通知推理阶段, 推理结束后通知所有写线程
+    for t in decoders:
+        t.join()
+    decoded_queue.put(_STOP)
+    infer.join()
+    for _ in range(write_workers):
+        write_queue.put(_STOP)
+    for t in writers:
+        t.join()
+    wall = time.perf_counter() - t0
+
+    report = [s.summary(wall) for s in (decode_stats, infer_stats, write_stats)]
+    print(f"\n流水线处理完成: {len(image_files)} 张图片, 用时 {wall:.2f}s")
+    print('%-8s%8s%8s%12s%10s%12s%12s' % ('stage', 'workers', 'items', 'img/s', 'util', 'queue_avg', 'queue_max'))
+    for r in report:
+        print('%-8s%8d%8d%12.2f%10.2f%12.1f%12d' % (r['stage'], r['workers'], r['items'], r['throughput'],
+                                                     r['utilization'], r['queue_depth_avg'], r['queue_depth_max']))
+    return report
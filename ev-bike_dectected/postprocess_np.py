@@ -0,0 +1,133 @@
+# 只依赖NumPy的后处理: 网格解码、置信度过滤、按类别偏移的批量NMS、坐标缩放和裁剪.
+# 结果与detect_local中的torch实现一致, 供只使用ONNX Runtime等推理运行时、不导入torch的进程使用.
+import numpy as np
+
+
+def make_grid(nx, ny):
+    yv, xv = np.meshgrid(np.arange(ny), np.arange(nx), indexing='ij')
+    return np.stack((xv, yv), 2).reshape((1, 1, ny, nx, 2)).astype(np.float32)
+
+
+def decode_outputs(outputs, img_shape, stride, anchor_grid):
+    """图外网格解码: outputs为各检测层sigmoid后的输出 (bs, na, ny*nx, no), 返回 (bs, N, no) 的预测"""
+    z = []
+    for y, s, anchors in zip(outputs, stride, anchor_grid):
+        bs, na, _, no = y.shape
+        ny, nx = int(img_shape[0] // s), int(img_shape[1] // s)
+        y = y.reshape(bs, na, ny, nx, no)
+        y[..., 0:2] = (y[..., 0:2] * 2. - 0.5 + make_grid(nx, ny)) * s  # xy
+        y[..., 2:4] = (y[..., 2:4] * 2) ** 2 * np.asarray(anchors, np.float32).reshape(1, na, 1, 1, 2)  # wh
+        z.append(y.reshape(bs, -1, no))
+    return np.concatenate(z, 1)
+
+
+def xywh2xyxy(x):
+    # Convert nx4 boxes from [x, y, w, h] to [x1, y1, x2, y2]
+    y = np.empty_like(x)
+    y[:, 0] = x[:, 0] - x[:, 2] / 2  # top left x
+    y[:, 1] = x[:, 1] - x[:, 3] / 2  # top left y
+    y[:, 2] = x[:, 0] + x[:, 2] / 2  # bottom right x
+    y[:, 3] = x[:, 1] + x[:, 3] / 2  # bottom right y
+    return y
+
+
+def nms(boxes, scores, iou_thres):
+    """贪心NMS, 与torchvision.ops.nms一致: 按分数从高到低保留, 删除与已保留框IoU大于iou_thres的框"""
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = np.argsort(-scores, kind='stable')
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = w * h
+        with np.errstate(invalid='ignore', divide='ignore'):
+            iou = inter / (areas[i] + areas[rest] - inter)
+        # 面积为0的框IoU为nan, 与torchvision一样只抑制IoU大于阈值的框, nan的框保留
+        order = rest[~(iou > iou_thres)]
+    return np.array(keep, dtype=np.int64)
+
+
+def nms_candidates(x, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, multi_label=False, max_det=300):
+    """对单张图像已解码的候选 (n, no) 做NMS, 返回 (n, 6) 的 xyxy, conf, cls"""
+    max_wh = 4096  # (pixels) maximum box width and height
+    max_nms = 30000  # maximum number of boxes into nms()
+
+    if not x.shape[0]:
+        return np.zeros((0, 6), np.float32)
+
+    x = x.astype(np.float32, copy=True)
+    x[:, 5:] *= x[:, 4:5]  # conf = obj_conf * cls_conf
+    box = xywh2xyxy(x[:, :4])
+
+    # Detections matrix nx6 (xyxy, conf, cls)
+    if multi_label:
+        i, j = (x[:, 5:] > conf_thres).nonzero()
+        x = np.concatenate((box[i], x[i, j + 5, None], j[:, None].astype(np.float32)), 1)
+    else:  # best class only
+        j = x[:, 5:].argmax(1)
+        conf = x[np.arange(len(x)), j + 5]
+        x = np.concatenate((box, conf[:, None], j[:, None].astype(np.float32)), 1)[conf > conf_thres]
+
+    if classes is not None:
+        x = x[(x[:, 5:6] == np.array(classes)).any(1)]
+
+    n = x.shape[0]
+    if not n:
+        return np.zeros((0, 6), np.float32)
+    elif n > max_nms:
+        x = x[np.argsort(-x[:, 4], kind='stable')[:max_nms]]
+
+    # Batched NMS: 按类别偏移坐标, 不同类别的框互不抑制
+    c = x[:, 5:6] * (0 if agnostic else max_wh)
+    i = nms(x[:, :4] + c, x[:, 4], iou_thres)
+    return x[i[:max_det]]
+
+
+def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, multi_label=False,
+                        max_det=300):
+    """非极大值抑制, prediction为 (bs, N, no) 的解码后预测, 返回每张图像 (n, 6) 的结果"""
+    xc = prediction[..., 4] > conf_thres  # candidates
+    return [nms_candidates(x[xc[xi]], conf_thres, iou_thres, classes, agnostic, multi_label, max_det)
+            for xi, x in enumerate(prediction)]
+
+
+def clip_coords(boxes, img_shape):
+    """将边界框坐标限制在图像范围内"""
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, img_shape[1])  # x1, x2
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, img_shape[0])  # y1, y2
+
+
+def scale_coords(img1_shape, coords, img0_shape, ratio_pad=None):
+    """将letterbox后输入尺寸下的坐标缩放回原图"""
+    if ratio_pad is None:  # calculate from img0_shape
+        gain = min(img1_shape[0] / img0_shape[0], img1_shape[1] / img0_shape[1])  # gain  = old / new
+        pad = (img1_shape[1] - img0_shape[1] * gain) / 2, (img1_shape[0] - img0_shape[0] * gain) / 2  # wh padding
+    else:
+        gain = ratio_pad[0][0]
+        pad = ratio_pad[1]
+
+    coords[:, [0, 2]] -= pad[0]  # x padding
+    coords[:, [1, 3]] -= pad[1]  # y padding
+    coords[:, :4] /= gain
+    clip_coords(coords, img0_shape)
+    return coords
+
+
+def postprocess(outputs, img_shape, img0_shapes, metadata, conf_thres=0.3, iou_thres=0.5, max_det=300):
+    """export.py导出模型的完整后处理
+
+    outputs为推理运行时返回的输出列表, img_shape为输入的 (h, w), img0_shapes为各原图尺寸,
+    metadata为导出时写入模型的配置. 返回每张图像原图坐标下 (n, 6) 的 xyxy, conf, cls
+    """
+    if metadata['decode'] == 'graph':
+        pred = outputs[0]
+    else:
+        pred = decode_outputs(outputs, img_shape, metadata['stride'], metadata['anchor_grid'])
+    dets = non_max_suppression(pred, conf_thres, iou_thres, max_det=max_det)
+    for det, img0_shape in zip(dets, img0_shapes):
+        det[:, :4] = scale_coords(img_shape, det[:, :4], img0_shape).round()
+    return dets
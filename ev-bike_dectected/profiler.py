@@ -0,0 +1,202 @@
+# 逐层性能分析: 在正常的前向推理中用hook记录每一层的耗时、FLOPs、参数量、激活内存和输出尺寸.
+# 只在被采样的前向推理中临时注册逐层hook, 未采样的请求只多一对模型级hook的开销, 可以在线上按1/N采样使用.
+# 结果可以汇总打印, 也可以导出为Chrome trace (chrome://tracing 或 Perfetto 打开) 或JSON.
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import torch
+import torch.nn as nn
+
+
+def conv_flops(m, x, y):
+    """卷积的浮点运算次数 (乘加各算一次)"""
+    kh, kw = m.kernel_size
+    if isinstance(m, nn.ConvTranspose2d):
+        return 2 * x.numel() * (m.out_channels // m.groups) * kh * kw
+    return 2 * y.numel() * (m.in_channels // m.groups) * kh * kw
+
+
+def _tensors(out):
+    if isinstance(out, torch.Tensor):
+        yield out
+    elif isinstance(out, (list, tuple)):
+        for o in out:
+            yield from _tensors(o)
+    elif isinstance(out, dict):
+        for o in out.values():
+            yield from _tensors(o)
+
+
+def _layer_name(i, m):
+    """层序号:模块类型, 类型取parse_model记录的名称, n>1的层不显示为Sequential"""
+    return '%s:%s' % (getattr(m, 'i', i), getattr(m, 'type', type(m).__name__).split('.')[-1])
+
+
+class LayerProfiler:
+    """模型的逐层分析器
+
+    every=N时每N次前向推理采样一次, 每次采样记录一条样本; 最多保留max_samples条最近的样本.
+    on_sample(sample) 在每次采样结束后调用, 可用于写入指标.
+    也可以不挂到模型上, 直接 with profiler.sample(): ... 分析一段代码中的前向推理.
+    """
+
+    def __init__(self, model, every=1, max_samples=100, on_sample=None):
+        self.model = model
+        self.every = max(int(every), 1)
+        self.samples = deque(maxlen=max_samples)
+        self.on_sample = on_sample
+        self.layers = list(model.model) if hasattr(model, 'model') else list(model.children())
+        self.calls = 0
+        self._handles = []
+        self._root_handles = []
+        self._current = None
+        self._cuda = False
+        self._lock = threading.Lock()  # 同一时刻只分析一次前向推理
+
+    def attach(self):
+        """在模型上注册采样hook, 之后每every次前向推理分析一次"""
+        self._root_handles = [self.model.register_forward_pre_hook(self._root_pre),
+                              self.model.register_forward_hook(self._root_post, always_call=True)]  # 出错时也结束采样
+        return self
+
+    def detach(self):
+        for h in self._root_handles:
+            h.remove()
+        self._root_handles = []
+        self._stop()
+
+    def __enter__(self):
+        return self.attach()
+
+    def __exit__(self, *exc):
+        self.detach()
+
+    def _root_pre(self, module, args):
+        self.calls += 1
+        if self.calls % self.every == 0 and self._lock.acquire(blocking=False):
+            self._start(args[0])
+
+    def _root_post(self, module, args, output):
+        if self._current is not None:
+            self._stop()
+
+    @contextmanager
+    def sample(self, x=None):
+        """分析with块中的一次前向推理"""
+        with self._lock:
+            self._start(x)
+            try:
+                yield self
+            finally:
+                self._stop(release=False)
+
+    def _start(self, x):
+        self._cuda = any(p.is_cuda for p in self.model.parameters())
+        self._sync()
+        self._current = {"start": time.perf_counter(), "input_shape": list(x.shape) if x is not None else None,
+                         "layers": []}
+        for i, layer in enumerate(self.layers):
+            record = {"layer": _layer_name(i, layer), "from": getattr(layer, 'f', -1),
+                      "params": sum(p.numel() for p in layer.parameters()), "flops": 0}
+            self._handles.append(layer.register_forward_pre_hook(self._layer_pre(record)))
+            self._handles.append(layer.register_forward_hook(self._layer_post(record)))
+            for m in layer.modules():
+                if isinstance(m, (nn.Conv2d, nn.ConvTranspose2d)):
+                    self._handles.append(m.register_forward_hook(self._count_flops(record)))
+
+    def _stop(self, release=True):
+        for h in self._handles:
+            h.remove()
+        self._handles = []
+        sample, self._current = self._current, None
+        if sample is None:
+            return
+        self._sync()
+        sample["total_ms"] = (time.perf_counter() - sample["start"]) * 1000
+        self.samples.append(sample)
+        if release:
+            self._lock.release()
+        if self.on_sample is not None:
+            self.on_sample(sample)
+
+    def _sync(self):
+        if self._cuda:
+            torch.cuda.synchronize()  # CUDA异步执行, 同步后计时才对应这一层
+
+    def _layer_pre(self, record):
+        def hook(module, args):
+            self._sync()
+            record["t"] = time.perf_counter()
+        return hook
+
+    def _layer_post(self, record):
+        def hook(module, args, output):
+            self._sync()
+            t = time.perf_counter()
+            outputs = list(_tensors(output))
+            record["start_ms"] = (record.pop("t") - self._current["start"]) * 1000
+            record["ms"] = (t - self._current["start"]) * 1000 - record["start_ms"]
+            record["activation_bytes"] = sum(o.numel() * o.element_size() for o in outputs)
+            record["shapes"] = [list(o.shape) for o in outputs]
+            self._current["layers"].append(record)
+        return hook
+
+    @staticmethod
+    def _count_flops(record):
+        def hook(module, args, output):
+            record["flops"] += conv_flops(module, args[0], output)
+        return hook
+
+    def summary(self):
+        """按层汇总所有样本: 平均耗时、耗时占比、FLOPs、参数量、激活内存和最近一次的输出尺寸"""
+        layers = {}
+        for sample in self.samples:
+            for r in sample["layers"]:
+                s = layers.setdefault(r["layer"], {"layer": r["layer"], "params": r["params"], "ms": []})
+                s["ms"].append(r["ms"])
+                s.update(flops=r["flops"], activation_bytes=r["activation_bytes"], shapes=r["shapes"])
+        rows = [{**s, "ms": sum(s["ms"]) / len(s["ms"])} for s in layers.values()]
+        total = sum(r["ms"] for r in rows) or 1.0
+        for r in rows:
+            r["share"] = r["ms"] / total
+        return rows
+
+    def print_summary(self, top=0):
+        """打印逐层统计, top>0时只打印最耗时的top层"""
+        rows = self.summary()
+        if top:
+            rows = sorted(rows, key=lambda r: -r["ms"])[:top]
+        print('%-18s%10s%8s%10s%12s%12s  %s' % ('layer', 'ms', 'share', 'GFLOPs', 'params', 'act_MB', 'shape'))
+        for r in rows:
+            print('%-18s%10.2f%7.1f%%%10.2f%12d%12.2f  %s' % (
+                r["layer"], r["ms"], r["share"] * 100, r["flops"] / 1e9, r["params"], r["activation_bytes"] / 2 ** 20,
+                'x'.join(map(str, r["shapes"][0])) if len(r["shapes"]) == 1 else len(r["shapes"])))
+        print('%d 个样本, 平均 %.2fms' % (len(self.samples),
+                                          sum(s["total_ms"] for s in self.samples) / max(len(self.samples), 1)))
+
+    def chrome_trace(self):
+        """Chrome trace格式: 每次采样一行, 每层一个事件"""
+        events = []
+        for n, sample in enumerate(self.samples):
+            ts = sample["start"] * 1e6
+            events.append({"name": "forward", "ph": "X", "pid": 0, "tid": n, "ts": ts, "dur": sample["total_ms"] * 1e3,
+                           "args": {"input_shape": sample["input_shape"]}})
+            for r in sample["layers"]:
+                events.append({"name": r["layer"], "ph": "X", "pid": 0, "tid": n, "ts": ts + r["start_ms"] * 1e3,
+                               "dur": r["ms"] * 1e3,
+                               "args": {k: r[k] for k in ("flops", "params", "activation_bytes", "shapes", "from")}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f)
+        return path
+
+    def export_json(self, path):
+        """导出所有样本和逐层汇总"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"samples": list(self.samples), "summary": self.summary()}, f, ensure_ascii=False, indent=2)
+        return path
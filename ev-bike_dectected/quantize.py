@@ -0,0 +1,170 @@
+import argparse
+import copy
+import json
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from backends import quantized_weights_path
+from helpers import latency_stats, list_images, timed
+from detect_local import EBikeDetector
+from export import ExportModel, export_metadata, export_torchscript, find_detect
+
+
+class TraceableModel(nn.Module):
+    """FX符号追踪用的包装: Model.forward 的augment/profile参数会被当作图输入, 这里直接调用forward_once"""
+
+    def __init__(self, model):
+        super(TraceableModel, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model.forward_once(x)
+
+
+def quantize_model(model, calib_inputs, engine='x86'):
+    """FX模式静态INT8量化: Conv/C3/SPP等主干和颈部量化为INT8, Detect不参与追踪, 保持FP32解码
+
+    calib_inputs为校准用的输入tensor列表, 用于统计各层激活的量化范围
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.fx.custom_config import PrepareCustomConfig
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    torch.backends.quantized.engine = engine
+    model = copy.deepcopy(model)
+    find_detect(model).raw_output = False  # EBikeDetector默认开启融合后处理, 量化模型需要输出解码后的预测
+    detect = type(find_detect(model))
+    qconfig_mapping = get_default_qconfig_mapping(engine).set_object_type(detect, None)
+    prepare_custom_config = PrepareCustomConfig().set_non_traceable_module_classes([detect])
+    prepared = prepare_fx(TraceableModel(model).eval(), qconfig_mapping, (calib_inputs[0],),
+                          prepare_custom_config=prepare_custom_config)
+    with torch.no_grad():
+        for x in calib_inputs:
+            prepared(x)
+    return convert_fx(prepared)
+
+
+def save_quantized(qmodel, example, path, engine):
+    """保存为TorchScript: FX量化后的模型无法直接pickle, TorchScript可由EBikeDetector的TorchScript后端加载"""
+    detect = find_detect(qmodel)
+    detect.grid = [torch.zeros(1)] * detect.nl  # trace时网格按输入尺寸在图内生成, 支持任意输入尺寸
+    metadata = export_metadata(detect, 'graph', example.shape[2:], dynamic=True)
+    metadata['quantized'] = engine
+    with torch.no_grad():
+        traced = torch.jit.trace(ExportModel(qmodel).eval(), example, check_trace=False)
+    return export_torchscript(traced, path, metadata)
+
+
+def load_labels(label_path, shape):
+    """读取YOLO格式标注 (class cx cy w h, 归一化坐标), 返回原图像素坐标下的 xyxy 数组"""
+    if not os.path.exists(label_path):
+        return np.zeros((0, 4))
+    labels = np.loadtxt(label_path, ndmin=2)
+    if not len(labels):
+        return np.zeros((0, 4))
+    h, w = shape[:2]
+    cx, cy, bw, bh = labels[:, 1] * w, labels[:, 2] * h, labels[:, 3] * w, labels[:, 4] * h
+    return np.stack((cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2), 1)
+
+
+def box_iou(box, boxes):
+    """一个框与一组框的IoU, xyxy格式"""
+    ix = np.clip(np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0]), 0, None)
+    iy = np.clip(np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1]), 0, None)
+    inter = ix * iy
+    area = (box[2] - box[0]) * (box[3] - box[1]) + (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / (area - inter + 1e-9)
+
+
+def match_detections(detections, gt, iou_thres=0.5):
+    """按置信度从高到低将检测框匹配到未被匹配的标注框, 返回每个检测框是否为TP"""
+    matched = np.zeros(len(gt), bool)
+    tp = []
+    for det in sorted(detections, key=lambda d: -d['confidence']):
+        hit = False
+        if len(gt):
+            iou = box_iou(np.array(det['bbox']), gt)
+            iou[matched] = 0
+            j = int(iou.argmax())
+            if iou[j] >= iou_thres:
+                matched[j] = hit = True
+        tp.append((det['confidence'], hit))
+    return tp
+
+
+def average_precision(tp, n_gt):
+    """由 (置信度, 是否TP) 列表计算AP, 全点插值"""
+    if not tp or not n_gt:
+        return 0.0
+    tp = np.array(sorted(tp, key=lambda t: -t[0]))[:, 1]
+    tpc, fpc = np.cumsum(tp), np.cumsum(1 - tp)
+    recall = np.concatenate(([0.], tpc / n_gt, [1.]))
+    precision = np.concatenate(([1.], tpc / (tpc + fpc), [0.]))
+    precision = np.flip(np.maximum.accumulate(np.flip(precision)))
+    i = np.where(recall[1:] != recall[:-1])[0]
+    return float(np.sum((recall[i + 1] - recall[i]) * precision[i + 1]))
+
+
+def evaluate(detector, image_files, label_dir, conf_thres=0.001, iou_thres=0.6):
+    """在标注集上评估mAP@0.5和单张检测延迟"""
+    tp, n_gt, latencies = [], 0, []
+    images = [detector.load_image(image_path) for image_path in image_files]
+    detector.detect(images[0], conf_thres, iou_thres)  # 预热
+    for image_path, image in zip(image_files, images):
+        image.img0  # 预先解码, 只统计推理耗时
+        detections, t = timed(detector.detect, image, conf_thres, iou_thres)
+        latencies.append(t)
+        gt = load_labels(os.path.join(label_dir, os.path.splitext(os.path.basename(image_path))[0] + '.txt'),
+                         image.shape)
+        tp.extend(match_detections(detections, gt))
+        n_gt += len(gt)
+    return {"map50": average_precision(tp, n_gt), "labels": n_gt, **latency_stats(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='电动车检测模型INT8静态量化')
+    parser.add_argument('--weights', type=str, default='pytorch_model.pt', help='FP32模型权重路径')
+    parser.add_argument('--calib', type=str, default='resources', help='校准图片文件夹')
+    parser.add_argument('--calib-images', type=int, default=100, help='最多使用的校准图片数')
+    parser.add_argument('--img-size', type=int, default=640, help='推理输入尺寸')
+    parser.add_argument('--engine', type=str, default='x86', help='量化后端: x86/fbgemm, ARM设备用qnnpack')
+    parser.add_argument('--output', type=str, default='', help='量化模型保存路径, 默认为<weights>_int8.torchscript')
+    parser.add_argument('--data', type=str, default='', help='标注集文件夹, 含images/和YOLO格式的labels/; 设置后输出精度-延迟对比')
+    parser.add_argument('--report', type=str, default='', help='将精度-延迟对比写入JSON文件')
+    opt = parser.parse_args()
+
+    # 量化在CPU上进行, 使用NCHW布局的融合模型
+    detector = EBikeDetector(opt.weights, 'cpu', img_size=opt.img_size, channels_last=False)
+    calib_files = list_images(opt.calib)[:opt.calib_images]
+    calib_inputs = [detector.to_tensor([detector.preprocess_array(detector.load_image(f).inference_img0)])
+                    for f in calib_files]
+    print(f"校准图片: {len(calib_inputs)} 张")
+
+    qmodel = quantize_model(detector.model, calib_inputs, opt.engine)
+    output = opt.output or quantized_weights_path(opt.weights)
+    save_quantized(qmodel, calib_inputs[0], output, opt.engine)
+
+    if not opt.data:
+        return
+    image_files = list_images(os.path.join(opt.data, 'images'))
+    label_dir = os.path.join(opt.data, 'labels')
+    rows = []
+    for name, weights in (('fp32', opt.weights), ('int8', output)):
+        d = EBikeDetector(weights, 'cpu', img_size=opt.img_size)
+        rows.append({"model": name, "size_mb": os.path.getsize(weights) / 1e6,
+                     **evaluate(d, image_files, label_dir)})
+
+    print('%-8s%10s%10s%10s%10s' % ('model', 'size_mb', 'mAP@0.5', 'mean_ms', 'p50_ms'))
+    for r in rows:
+        print('%-8s%10.1f%10.3f%10.1f%10.1f' % (r['model'], r['size_mb'], r['map50'], r['mean_ms'], r['p50_ms']))
+    if opt.report:
+        with open(opt.report, 'w', encoding='utf-8') as f:
+            json.dump({"images": len(image_files), "engine": opt.engine, "rows": rows}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到: {opt.report}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+# 按图像内容缓存检测结果: 键为 图像字节的sha256 + 模型校验和及推理配置 + 阈值.
+# 两级缓存: 进程内LRU, 以及可选的SQLite文件(多个进程可共用), 按总大小淘汰最久未访问的条目.
+# 命中时直接返回检测结果, 不解码图像也不做推理.
+# CandidateCache在内存中保留每张图NMS之前的候选, 同一张图换阈值查询时只需要重新做NMS.
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(content_hash, model_tag, conf_thres, iou_thres):
+    return hashlib.sha256(('%s|%s|%r|%r' % (content_hash, model_tag, float(conf_thres), float(iou_thres)))
+                          .encode()).hexdigest()
+
+
+class ResultCache:
+    """检测结果缓存
+
+    memory_items为内存LRU的条目数; path为SQLite文件路径, 为None时只使用内存;
+    max_disk_bytes为磁盘缓存的总大小上限, 超过后删除最久未访问的条目直到低于上限的90%
+    """
+
+    def __init__(self, path=None, memory_items=1024, max_disk_bytes=256 * 2 ** 20):
+        self.memory_items = memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')  # 多个进程同时读写
+            self._db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                             'size INTEGER NOT NULL, accessed REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+            self._disk_bytes = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    def get(self, key):
+        """返回缓存的检测结果列表, 未命中返回None"""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return json.loads(value)
+            row = None
+            if self._db is not None:
+                row = self._db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self._db.execute('UPDATE results SET accessed = ? WHERE key = ?', (time.time(), key))
+            self._remember(key, row[0])
+            self.stats["disk_hits"] += 1
+            return json.loads(row[0])
+
+    def put(self, key, results):
+        value = json.dumps(results, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, value)
+            if self._db is None:
+                return
+            self._db.execute('INSERT OR REPLACE INTO results (key, value, size, accessed) VALUES (?, ?, ?, ?)',
+                             (key, value, len(value), time.time()))
+            # 本进程内累计的大小只是估计值(其他进程也会写入), 超过上限时再按实际大小淘汰
+            self._disk_bytes += len(value)
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict()
+
+    def _remember(self, key, value):
+        """放入内存LRU, 保存JSON字符串, 每次取出都是新的对象"""
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        self._disk_bytes = total
+        if total <= self.max_disk_bytes:
+            return
+        target, freed = total - int(self.max_disk_bytes * 0.9), 0
+        keys = []
+        for key, size in self._db.execute('SELECT key, size FROM results ORDER BY accessed'):
+            keys.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self._db.executemany('DELETE FROM results WHERE key = ?', keys)
+        self._disk_bytes = total - freed
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM results')
+                self._disk_bytes = 0
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class CandidateCache:
+    """NMS之前候选(detect_local.Candidates)的内存LRU, 按候选占用的总字节数淘汰, 线程安全"""
+
+    def __init__(self, max_bytes=256 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.stats = {"hits": 0, "misses": 0}
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            candidates = self._items.get(key)
+            if candidates is None:
+                self.stats["misses"] += 1
+                return None
+            self._items.move_to_end(key)
+            self.stats["hits"] += 1
+            return candidates
+
+    def put(self, key, candidates):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._items[key] = candidates
+            self.nbytes += candidates.nbytes
+            while self.nbytes > self.max_bytes and len(self._items) > 1:
+                _, old = self._items.popitem(last=False)
+                self.nbytes -= old.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
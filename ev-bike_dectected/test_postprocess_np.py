@@ -0,0 +1,52 @@
+# postprocess_np与detect_local中torch实现的一致性测试: 随机预测(含面积为0的退化框)上NMS和坐标缩放的结果应相同
+import numpy as np
+import pytest
+import torch
+
+import detect_local
+import postprocess_np
+
+
+def random_prediction(seed, bs=2, n=600, nc=2, degenerate=0.1):
+    """随机的解码后预测 (bs, n, 5+nc): xywh在640x640内, 部分框宽或高为0"""
+    rng = np.random.default_rng(seed)
+    pred = np.empty((bs, n, 5 + nc), np.float32)
+    pred[..., 0:2] = rng.uniform(0, 640, (bs, n, 2))
+    pred[..., 2:4] = rng.uniform(2, 120, (bs, n, 2))
+    zero = rng.random((bs, n, 2)) < degenerate
+    pred[..., 2:4][zero] = 0
+    pred[..., 4:] = rng.random((bs, n, 1 + nc))
+    return pred
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('agnostic', [False, True])
+@pytest.mark.parametrize('multi_label', [False, True])
+def test_non_max_suppression(seed, agnostic, multi_label):
+    pred = random_prediction(seed)
+    expected = detect_local.non_max_suppression(torch.from_numpy(pred.copy()), 0.25, 0.45, agnostic=agnostic,
+                                                multi_label=multi_label)
+    with np.errstate(all='raise'):  # 退化框不应产生RuntimeWarning
+        output = postprocess_np.non_max_suppression(pred.copy(), 0.25, 0.45, agnostic=agnostic,
+                                                    multi_label=multi_label)
+    assert len(output) == len(expected)
+    for det, ref in zip(output, expected):
+        np.testing.assert_allclose(det, ref.numpy(), rtol=1e-6, atol=1e-4)
+
+
+def test_nms_keeps_zero_area_boxes():
+    boxes = np.array([[10, 10, 10, 10], [10, 10, 10, 10], [0, 0, 50, 50], [0, 0, 50, 49]], np.float32)
+    scores = np.array([0.9, 0.8, 0.7, 0.6], np.float32)
+    import torchvision
+    expected = torchvision.ops.nms(torch.from_numpy(boxes), torch.from_numpy(scores), 0.5).numpy()
+    np.testing.assert_array_equal(postprocess_np.nms(boxes, scores, 0.5), expected)
+
+
+@pytest.mark.parametrize('img0_shape', [(1080, 1920), (3648, 5472), (480, 640), (1920, 1080)])
+def test_scale_coords(img0_shape):
+    img1_shape = detect_local.letterbox_shape(img0_shape, 640, True)
+    rng = np.random.default_rng(0)
+    coords = rng.uniform(-20, 660, (200, 4)).astype(np.float32)
+    expected = detect_local.scale_coords(img1_shape, torch.from_numpy(coords.copy()), img0_shape)
+    output = postprocess_np.scale_coords(img1_shape, coords.copy(), img0_shape)
+    np.testing.assert_allclose(output, expected.numpy(), rtol=1e-6, atol=1e-3)
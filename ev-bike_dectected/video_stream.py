@@ -0,0 +1,247 @@
+# 视频文件(无人机MP4)和RTSP/摄像头流的检测.
+# 后台线程用OpenCV读取帧, 按采样频率取帧并跳过与上一采样帧几乎相同的帧, 放入有界队列;
+# 调用方线程从队列中凑batch推理, 以生成器逐帧返回结果. 内存中最多只有队列容量加一个batch的帧,
+# 一小时的视频也不会整段解码进内存.
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from detect_local import EBikeDetector, ImageContext, parse_shape
+
+logger = logging.getLogger(__name__)
+
+# 队列结束标记
+_STOP = object()
+
+
+def is_live(source):
+    """摄像头序号和网络流是实时源: 读取跟不上时丢弃旧帧, 断流后重连"""
+    return isinstance(source, int) or str(source).isdigit() or '://' in str(source)
+
+
+def thumbnail(frame, size=(64, 36)):
+    """用于判断相邻帧是否几乎相同的灰度缩略图"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+class VideoReader:
+    """后台读取视频帧的线程
+
+    sample_fps>0时按视频时间每秒最多取sample_fps帧, 未采样的帧只grab不做颜色转换;
+    dedup_threshold>0时, 与上一采样帧缩略图的平均灰度差低于该值的帧视为重复, 直接跳过.
+    live为True时(默认按source判断)队列满了丢弃最旧的帧; 网络流和摄像头读取失败后重连最多reconnect次, 文件读完即结束.
+    realtime为True时按视频帧率读取本地文件, 配合live=True用来模拟RTSP等实时源.
+    读出的帧为 (帧序号, 视频时间秒, BGR图像), 通过iter()按顺序取出
+    """
+
+    def __init__(self, source, sample_fps=0, dedup_threshold=0, queue_size=32, live=None, realtime=False,
+                 reconnect=3):
+        self.source = int(source) if str(source).isdigit() else source
+        self.sample_fps = sample_fps
+        self.dedup_threshold = dedup_threshold
+        self.live = is_live(self.source) if live is None else live
+        self.realtime = realtime
+        self.reconnect = reconnect
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.stats = {"read": 0, "sampled": 0, "duplicates": 0, "dropped": 0, "reconnects": 0}
+        self.fps = 0.0
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __iter__(self):
+        """按顺序取出读到的帧, 读取线程出错时抛出其异常"""
+        while True:
+            item = self.frames.get()
+            if item is _STOP:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield item
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            raise IOError(f"无法打开视频: {self.source}")
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 25.0  # 部分网络流不报告帧率
+        return cap
+
+    def _put(self, item):
+        """有界队列: 实时源丢弃最旧的帧, 文件等待消费者(背压), 停止后不再阻塞"""
+        while not self._stop.is_set():
+            try:
+                self.frames.put(item, block=not self.live or item is _STOP, timeout=0.1)
+                return
+            except queue.Full:
+                if self.live:
+                    try:
+                        self.frames.get_nowait()
+                        self.stats["dropped"] += 1
+                    except queue.Empty:
+                        pass
+
+    def _run(self):
+        cap = None
+        try:
+            cap = self._open()
+            index, start, next_time, last, failures = -1, 0, 0.0, None, 0
+            t0 = time.perf_counter()
+            while not self._stop.is_set():
+                if not cap.grab():
+                    if not is_live(self.source):
+                        break
+                    if failures >= self.reconnect:
+                        raise IOError(f"视频流中断, 重连 {failures} 次失败: {self.source}")
+                    failures += 1
+                    self.stats["reconnects"] += 1
+                    logger.warning(f"视频流中断, 第 {failures} 次重连: {self.source}")
+                    cap.release()
+                    if self._stop.wait(min(2 ** failures, 10)):  # 退避等待期间可以被stop()打断
+                        break
+                    try:
+                        cap = self._open()
+                        # 重新打开后流的时间戳从头开始
+                        start, next_time, t0 = index + 1, 0.0, time.perf_counter()
+                    except IOError as e:
+                        # 流仍未恢复: 计为一次失败继续退避重试, 用完重连次数后才结束
+                        logger.warning(f"重连失败: {str(e)}")
+                        cap = cv2.VideoCapture()  # 未打开, grab()返回False, 进入下一次重连
+                    continue
+                failures = 0
+                index += 1
+                self.stats["read"] += 1
+                msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+                timestamp = msec / 1000 if msec > 0 else (index - start) / self.fps
+                if self.realtime:
+                    delay = timestamp - (time.perf_counter() - t0)
+                    if delay > 0:
+                        time.sleep(delay)
+                if self.sample_fps and timestamp + 1e-6 < next_time:
+                    continue  # 未采样的帧只解复用, 不转换为BGR
+                ok, frame = cap.retrieve()
+                if not ok:
+                    continue
+                if self.sample_fps:
+                    # 按固定间隔推进, 重复帧也占用采样位置, 去重只丢弃已被采样选中的帧; 断流后从当前帧重新计时
+                    next_time = max(next_time, timestamp - 1 / self.sample_fps) + 1 / self.sample_fps
+                if self.dedup_threshold:
+                    thumb = thumbnail(frame)
+                    if last is not None and np.abs(thumb - last).mean() < self.dedup_threshold:
+                        self.stats["duplicates"] += 1
+                        continue
+                    last = thumb
+                self.stats["sampled"] += 1
+                self._put((index, timestamp, frame))
+        except Exception as e:
+            self.error = e
+        finally:
+            if cap is not None:
+                cap.release()
+            self._put(_STOP)
+
+
+def _infer(detector, batch, conf_thres, iou_thres, keep_frames):
+    """一个batch的帧做一次前向推理, 按顺序生成每帧的结果"""
+    images = [ImageContext.from_array(frame) for _, _, frame in batch]
+    imgs, shapes = detector.preprocess_batch(images)
+    for (index, timestamp, frame), results in zip(batch, detector.infer_batch(imgs, shapes, conf_thres, iou_thres)):
+        out = {"frame": index, "time": timestamp, "detections": results}
+        if keep_frames:
+            out["image"] = frame
+        yield out
+
+
+def detect_stream(detector, source, batch_size=4, sample_fps=0, dedup_threshold=0, conf_thres=0.3, iou_thres=0.5,
+                  queue_size=32, live=None, realtime=False, keep_frames=False):
+    """逐帧检测视频, 生成 {"frame", "time", "detections"} (keep_frames时另有BGR图像"image")
+
+    读取和采样在后台线程, 推理在调用方线程; 队列暂时为空时不等待凑满batch. 提前结束迭代时读取线程随之停止
+    """
+    reader = VideoReader(source, sample_fps, dedup_threshold, queue_size, live, realtime).start()
+    try:
+        batch = []
+        while True:
+            try:
+                # 第一帧阻塞等待, 之后只取队列中已有的帧
+                item = reader.frames.get_nowait() if batch else reader.frames.get()
+            except queue.Empty:
+                item = None
+            if item is not None and item is not _STOP:
+                batch.append(item)
+                if len(batch) < batch_size:
+                    continue
+            if batch:
+                yield from _infer(detector, batch, conf_thres, iou_thres, keep_frames)
+                batch = []
+            if item is _STOP:
+                break
+        if reader.error is not None:
+            raise reader.error
+    finally:
+        reader.stop()
+        logger.info(f"视频读取统计: {reader.stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='视频文件和RTSP流的电动车检测')
+    parser.add_argument('--weights', type=str, default='pytorch_model.pt', help='模型权重路径')
+    parser.add_argument('--device', type=str, default=None, help='cpu 或 cuda:0, 默认自动选择')
+    parser.add_argument('--source', type=str, required=True, help='视频文件、rtsp://地址或摄像头序号')
+    parser.add_argument('--sample-fps', type=float, default=2, help='每秒视频最多检测的帧数, 0为每帧都检测')
+    parser.add_argument('--dedup-threshold', type=float, default=0,
+                        help='与上一检测帧缩略图的平均灰度差(0-255)低于该值时跳过, 0为不跳过')
+    parser.add_argument('--batch-size', type=int, default=4, help='每次前向推理的帧数')
+    parser.add_argument('--queue-size', type=int, default=32, help='读取线程与推理之间缓存的最大帧数')
+    parser.add_argument('--realtime', action='store_true', help='按视频帧率读取本地文件, 模拟RTSP实时流')
+    parser.add_argument('--img-size', type=int, default=640, help='推理输入尺寸')
+    parser.add_argument('--input-shapes', type=parse_shape, nargs='+', default=None,
+                        help='规范输入尺寸列表, 如 384x640 640x640')
+    parser.add_argument('--conf-thres', type=float, default=0.3)
+    parser.add_argument('--iou-thres', type=float, default=0.5)
+    parser.add_argument('--output', type=str, default='', help='逐帧结果JSON Lines路径, 默认 results/<视频名>.jsonl')
+    parser.add_argument('--save-frames', action='store_true', help='保存有检测结果的帧的可视化图像')
+    parser.add_argument('--log-level', type=str, default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    opt = parser.parse_args()
+    logging.basicConfig(level=opt.log_level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    kwargs = {'device': opt.device} if opt.device else {}
+    detector = EBikeDetector(opt.weights, img_size=opt.img_size, input_shapes=opt.input_shapes, **kwargs)
+    name = os.path.splitext(os.path.basename(opt.source.rstrip('/')))[0] or 'stream'
+    output = opt.output or os.path.join('results', f'{name}.jsonl')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    t, frames, detections = time.perf_counter(), 0, 0
+    with open(output, 'w', encoding='utf-8') as f:
+        for r in detect_stream(detector, opt.source, opt.batch_size, opt.sample_fps, opt.dedup_threshold,
+                               opt.conf_thres, opt.iou_thres, opt.queue_size, realtime=opt.realtime,
+                               keep_frames=opt.save_frames):
+            frames += 1
+            detections += len(r["detections"])
+            f.write(json.dumps({"frame": r["frame"], "time": round(r["time"], 3), "detections": r["detections"]},
+                               ensure_ascii=False) + '\n')
+            if opt.save_frames and r["detections"]:
+                detector.visualize(ImageContext.from_array(r["image"], f'{name}_{r["frame"]:06d}.jpg'), r["detections"])
+    t = time.perf_counter() - t
+    logger.info(f"处理完成: {frames} 帧, {detections} 个检测框, 用时 {t:.2f}s ({frames / t:.1f} 帧/s), 结果: {output}")
+
+
+if __name__ == "__main__":
+    main()